@@ -1,18 +1,35 @@
 import os
+import re
+import json
+import sqlite3
+import time
+import uuid
+import random
+import socket
+import atexit
+import zlib
+import multiprocessing
+import asyncio
+import threading
 import datetime as dt
 from pathlib import Path
-from functools import wraps
+from functools import wraps, lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, abort, g
+from jinja2 import Environment, ChoiceLoader, DictLoader, FileSystemLoader
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import pytz
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
 
-from db import init_db, get_conn
-from importer import load_people_from_excel
-from notify import send_email, send_sms
+from db import (init_db, get_conn, get_db, release_db, close_db, bulk_upsert_people, fts_enabled,
+                sync_alert_thresholds, cache_generation, acquire_lease, release_lease)
+from importer import iter_people_from_excel, iter_chunks
+from notify import dispatch_messages, dispatch_messages_async, sms_segments, set_send_share
 
 load_dotenv()
 
@@ -33,13 +50,47 @@ def parse_iso_date(s: str):
         except ValueError:
             return None
 
-def days_left(vencimiento_iso: str, tzname: str):
-    if not vencimiento_iso:
-        return None
-    tz = pytz.timezone(tzname)
-    today = dt.datetime.now(tz).date()
-    venc = dt.date.fromisoformat(vencimiento_iso)
-    return (venc - today).days
+@lru_cache(maxsize=None)
+def get_timezone(tzname: str):
+    return pytz.timezone(tzname)
+
+@lru_cache(maxsize=4096)
+def _iso_ordinal(fecha_iso: str):
+    return dt.date.fromisoformat(fecha_iso).toordinal()
+
+class DateContext:
+    """
+    "Hoy" fijado una sola vez por petición o por chequeo en la zona horaria configurada,
+    para que todas las filas usen la misma fecha aunque la ejecución cruce la medianoche.
+    Los días restantes se calculan restando ordinales, sin consultar la zona horaria por fila.
+    """
+
+    def __init__(self, tzname: str = None, today: dt.date = None):
+        self.tzname = tzname or os.getenv("TIMEZONE", "America/Bogota")
+        self.tz = get_timezone(self.tzname)
+        self.today = today or dt.datetime.now(self.tz).date()
+        self.ordinal = self.today.toordinal()
+        self.iso = self.today.isoformat()
+
+    def shift(self, days: int):
+        """Fecha ISO a `days` días de hoy"""
+        return (self.today + dt.timedelta(days=days)).isoformat()
+
+    def days_left(self, vencimiento_iso: str):
+        if not vencimiento_iso:
+            return None
+        return _iso_ordinal(vencimiento_iso) - self.ordinal
+
+    def days_left_many(self, fechas):
+        """Días restantes para una lista de fechas ISO (None si la fecha está vacía)"""
+        today = self.ordinal
+        return [_iso_ordinal(f) - today if f else None for f in fechas]
+
+def request_dates():
+    """DateContext de la petición actual, creado en el primer uso"""
+    if "dates" not in g:
+        g.dates = DateContext()
+    return g.dates
 
 def get_alert_days():
     raw = os.getenv("ALERT_DAYS", "60,30,15,7,1,0")
@@ -54,24 +105,157 @@ def get_alert_days():
             pass
     return sorted(set(out), reverse=True)
 
-def already_sent(conn, person_id, especializacion, fecha_vencimiento, days_before, channel):
+def pending_notifications(conn, dates, lookback=0):
+    """
+    Devuelve una fila por persona y canal con las alertas de hoy que aún no se han enviado.
+    Las alertas que tocan salen de alert_schedule con una búsqueda por due_date; con
+    lookback > 0 se incluyen también los umbrales cruzados en los últimos `lookback` días
+    (servidor caído o job fallido), usando para cada persona solo el umbral más urgente.
+    La deduplicación contra notifications se resuelve en la misma consulta (anti-join).
+    """
+    since = dates.shift(-lookback)
     cur = conn.cursor()
     cur.execute("""
-        SELECT 1 FROM notifications
-        WHERE person_id=? AND especializacion=? AND fecha_vencimiento=? AND days_before=? AND channel=?
-        LIMIT 1
-    """, (person_id, especializacion, fecha_vencimiento, days_before, channel))
-    return cur.fetchone() is not None
-
-def mark_sent(conn, person_id, especializacion, fecha_vencimiento, days_before, channel):
+        WITH due(person_id, days_before) AS (
+                SELECT person_id, MIN(days_before) FROM alert_schedule
+                WHERE due_date BETWEEN :since AND :today
+                GROUP BY person_id
+             ),
+             channels(channel) AS (VALUES ('email'), ('sms'))
+        SELECT p.*, CAST(julianday(p.fecha_vencimiento) - julianday(:today) AS INTEGER) AS days_left,
+               t.days_before, c.channel
+        FROM due t
+        JOIN people p ON p.id = t.person_id
+        JOIN channels c ON (c.channel = 'email' AND COALESCE(p.email, '') <> '')
+                        OR (c.channel = 'sms' AND COALESCE(p.celular, '') <> '')
+        WHERE NOT EXISTS (
+            SELECT 1 FROM notifications n
+            WHERE n.person_id = p.id AND n.especializacion = p.especializacion
+              AND n.fecha_vencimiento = p.fecha_vencimiento AND n.days_before = t.days_before
+              AND n.channel = c.channel
+        )
+        AND NOT EXISTS (
+            -- Los que ya esperan reintento en el outbox los envía drain_outbox
+            SELECT 1 FROM outbox_items oi
+            JOIN outbox o ON o.id = oi.outbox_id AND o.status IN ('pending', 'sending')
+            WHERE oi.person_id = p.id AND oi.especializacion = p.especializacion
+              AND oi.fecha_vencimiento = p.fecha_vencimiento AND oi.days_before = t.days_before
+              AND oi.channel = c.channel
+        )
+        ORDER BY p.id, c.channel
+    """, {"since": since, "today": dates.iso})
+    return cur.fetchall()
+
+def mark_sent_many(conn, keys):
+    """Registra en una sola transacción las notificaciones enviadas (person_id, esp, fecha, días, canal)"""
+    if not keys:
+        return
+    with conn:
+        conn.executemany("""
+            INSERT OR IGNORE INTO notifications (person_id, especializacion, fecha_vencimiento, days_before, channel)
+            VALUES (?,?,?,?,?)
+        """, keys)
+
+# ============ ESTADÍSTICAS ============
+_stats_cache = {"key": None, "value": None, "expires": 0.0, "generation": 0}
+_stats_lock = threading.Lock()
+
+def get_dashboard_stats(conn, dates):
+    """
+    Contadores del panel (total, próximos a vencer y vencidos) calculados con una sola
+    consulta agregada y guardados en memoria durante STATS_CACHE_TTL segundos.
+    La caché se descarta al cambiar la fecha local o al modificar la tabla people.
+    """
+    now = time.monotonic()
+    with _stats_lock:
+        if _stats_cache["key"] == dates.today and now < _stats_cache["expires"]:
+            return dict(_stats_cache["value"])
+        generation = _stats_cache["generation"]
+
+    limite_proximo = dates.shift(30)
     cur = conn.cursor()
     cur.execute("""
-        INSERT OR IGNORE INTO notifications (person_id, especializacion, fecha_vencimiento, days_before, channel)
-        VALUES (?,?,?,?,?)
-    """, (person_id, especializacion, fecha_vencimiento, days_before, channel))
-    conn.commit()
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(fecha_vencimiento BETWEEN ? AND ?), 0) AS proximo,
+               COALESCE(SUM(fecha_vencimiento < ?), 0) AS vencido
+        FROM people
+    """, (dates.iso, limite_proximo, dates.iso))
+    stats = dict(cur.fetchone())
+
+    with _stats_lock:
+        # Si hubo una escritura mientras se consultaba, no se guarda un valor viejo
+        if _stats_cache["generation"] == generation:
+            _stats_cache.update(key=dates.today, value=stats,
+                                expires=now + float(os.getenv("STATS_CACHE_TTL", "60")))
+    return dict(stats)
+
+def upcoming_alert_load(conn, dates, days=14):
+    """Alertas programadas por día para los próximos `days` días, según alert_schedule"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT due_date, COUNT(*) AS total
+        FROM alert_schedule
+        WHERE due_date BETWEEN ? AND ?
+        GROUP BY due_date
+        ORDER BY due_date
+    """, (dates.iso, dates.shift(days)))
+    return cur.fetchall()
+
+def invalidate_dashboard_stats():
+    with _stats_lock:
+        _stats_cache["key"] = None
+        _stats_cache["generation"] += 1
 
 # ============ AUTENTICACIÓN ============
+_role_cache = OrderedDict()  # user_id -> (rol, expira, generación de users)
+_role_lock = threading.Lock()
+_users_seen = threading.local()  # (conexión, data_version, generación) vistos por este hilo
+
+def users_generation(conn):
+    """
+    Generación de la tabla users, que suben sus triggers con cada cambio de rol o borrado
+    hecho desde cualquier proceso. Solo se relee si PRAGMA data_version indica que otra
+    conexión escribió en la base desde la última lectura de este hilo.
+    """
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    seen = getattr(_users_seen, "value", None)
+    if seen is None or seen[0] is not conn or seen[1] != data_version:
+        seen = _users_seen.value = (conn, data_version, cache_generation(conn, "users"))
+    return seen[2]
+
+def get_user_role(user_id):
+    """
+    Rol actual del usuario con una caché LRU en memoria (ROLE_CACHE_SIZE entradas,
+    ROLE_CACHE_TTL segundos). Cada entrada guarda la generación de users con la que se
+    leyó: un cambio de rol o un borrado en cualquier worker la invalida en todos.
+    """
+    conn = get_db()
+    generation = users_generation(conn)
+    now = time.monotonic()
+    with _role_lock:
+        cached = _role_cache.get(user_id)
+        if cached and now < cached[1] and cached[2] == generation:
+            _role_cache.move_to_end(user_id)
+            return cached[0]
+
+    cur = conn.cursor()
+    cur.execute("SELECT role FROM users WHERE id=?", (user_id,))
+    user = cur.fetchone()
+    role = user["role"] if user else None
+
+    with _role_lock:
+        _role_cache[user_id] = (role, now + float(os.getenv("ROLE_CACHE_TTL", "30")), generation)
+        _role_cache.move_to_end(user_id)
+        while len(_role_cache) > int(os.getenv("ROLE_CACHE_SIZE", "256")):
+            _role_cache.popitem(last=False)
+    return role
+
+def invalidate_user_role(user_id):
+    # La conexión que hizo el cambio no ve subir su propio data_version: se relee la generación
+    _users_seen.value = None
+    with _role_lock:
+        _role_cache.pop(user_id, None)
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -88,82 +272,533 @@ def admin_required(f):
             flash("Debes iniciar sesión primero.", "warn")
             return redirect(url_for('login'))
         
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT role FROM users WHERE id=?", (session['user_id'],))
-        user = cur.fetchone()
-        conn.close()
-        
-        if not user or user['role'] not in ['admin', 'superuser']:
+        if get_user_role(session['user_id']) not in ['admin', 'superuser']:
             flash("No tienes permisos para acceder a esta sección.", "warn")
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return decorated_function
 
+# ============ LOCKS ENTRE PROCESOS ============
+def lease_owner():
+    """Identifica a este proceso (equipo:pid); se calcula en cada llamada por los fork de gunicorn"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def hold_lease(name, ttl, owner=None):
+    """Toma o renueva el lock `name` en la base de datos; True si `owner` (por defecto este proceso) lo tiene"""
+    conn = get_db()
+    try:
+        return acquire_lease(conn, name, owner or lease_owner(), ttl)
+    finally:
+        release_db()
+
+def drop_lease(name, owner=None):
+    conn = get_db()
+    try:
+        release_lease(conn, name, owner or lease_owner())
+    finally:
+        release_db()
+
+SEND_LEASE = "send"
+
+def hold_send_lease(owner, wait=0):
+    """
+    Lock de envío: un solo envío masivo a la vez entre todos los procesos (chequeo diario,
+    /run-check y outbox). Los límites de EMAIL_RATE / SMS_RATE y SMTP_POOL_SIZE son de cada
+    proceso; con este lock valen para toda la instalación. Con wait > 0 se reintenta
+    durante `wait` segundos antes de rendirse.
+    """
+    ttl = int(os.getenv("SEND_LEASE_TTL", "3600"))
+    deadline = time.monotonic() + wait
+    while not hold_lease(SEND_LEASE, ttl, owner):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(5.0, remaining))
+    return True
+
 # ============ ALERTAS ============
-def run_alert_check():
-    tzname = os.getenv("TIMEZONE", "America/Bogota")
-    alerts = get_alert_days()
+def _dias_texto(d):
+    return f"faltan {d} días" if d >= 0 else f"venció hace {-d} días"
+
+# Plantillas Jinja por defecto; un archivo con el mismo nombre en MESSAGE_TEMPLATES_DIR las reemplaza.
+# Variables: nombre (vacío si el destinatario recibe avisos de varias personas), personas (cuántas),
+# item (la primera especialización) e items (todas, de la más urgente a la menos, cada una con su persona).
+DEFAULT_MESSAGE_TEMPLATES = {
+    "email_subject.txt": (
+        "{% if item.days_left < 0 %}[Alerta] Especialización vencida hace {{ -item.days_left }} días - {{ nombre }}"
+        "{% else %}[Alerta] Vencimiento de especialización en {{ item.days_left }} días - {{ nombre }}{% endif %}"
+    ),
+    "email_body.txt": (
+        "Hola {{ nombre }}.\n\n"
+        "Tu especialización: {{ item.especializacion }}\n"
+        "Vence el: {{ item.fecha_vencimiento }} ({{ item.days_left|dias_texto }}).\n\n"
+        "Te recomendamos programar el reentrenamiento con anticipación.\n\n"
+        "Saludos,\nSistema de Alerta Temprana"
+    ),
+    "digest_subject.txt": (
+        "[Alerta] {{ items|length }} especializaciones próximas a vencer"
+        "{% if nombre %} - {{ nombre }}{% else %} ({{ personas }} personas){% endif %}"
+    ),
+    "digest_body.txt": (
+        "Hola{% if nombre %} {{ nombre }}{% endif %}.\n\n"
+        "{% if nombre %}Tus siguientes especializaciones{% else %}Las siguientes especializaciones{% endif %}"
+        " están próximas a vencer:\n"
+        "{% for p in items %}\n"
+        "- {% if not nombre %}{{ p.persona }}, {% endif %}"
+        "{{ p.especializacion }}: vence el {{ p.fecha_vencimiento }} ({{ p.days_left|dias_texto }})\n"
+        "{% endfor %}\n"
+        "\nTe recomendamos programar el reentrenamiento con anticipación.\n\n"
+        "Saludos,\nSistema de Alerta Temprana"
+    ),
+    # Texto corto y sin tildes para que quepa en la codificación GSM-7 (160 caracteres por segmento)
+    "sms.txt": (
+        "Alerta{% if nombre %}: {{ nombre }}{% endif %}, "
+        "{% if items|length == 1 %}tu especializacion {{ item.especializacion }} "
+        "{% if item.days_left < 0 %}vencio hace {{ -item.days_left }} dias{% else %}vence el {{ item.fecha_vencimiento }}{% endif %}"
+        "{% else %}{{ items|length }} especializaciones por vencer: "
+        "{% for p in items %}{% if not nombre %}{{ p.persona }} - {% endif %}"
+        "{{ p.especializacion }} ({{ p.fecha_vencimiento }}){{ ', ' if not loop.last }}{% endfor %}"
+        "{% endif %}. Programa el reentrenamiento."
+    ),
+}
+
+def load_message_templates():
+    """
+    Compila una sola vez por chequeo las plantillas de mensajes y las devuelve por nombre.
+    Las de MESSAGE_TEMPLATES_DIR (si existe) tienen prioridad sobre las de DEFAULT_MESSAGE_TEMPLATES.
+    """
+    loaders = [DictLoader(DEFAULT_MESSAGE_TEMPLATES)]
+    templates_dir = os.getenv("MESSAGE_TEMPLATES_DIR")
+    if templates_dir:
+        loaders.insert(0, FileSystemLoader(templates_dir))
+    env = Environment(loader=ChoiceLoader(loaders), trim_blocks=True, autoescape=False)
+    env.filters["dias_texto"] = _dias_texto
+    return {name: env.get_template(name) for name in DEFAULT_MESSAGE_TEMPLATES}
+
+def render_messages(groups, templates):
+    """
+    Renderiza de una vez todos los mensajes de un chequeo, antes de empezar a enviar.
+    groups: lista de (canal, items) con las filas de pending_notifications de cada destinatario.
+    """
+    messages = []
+    for channel, items in groups:
+        items = sorted((dict(p, persona=f'{p["nombre"]} {p["apellido"]}'.strip()) for p in items),
+                       key=lambda p: p["days_left"])
+        first = items[0]
+        # Un buzón o celular compartido (empresa, supervisor) puede recibir avisos de varias
+        # personas: entonces no se saluda a nadie en particular y cada línea lleva su nombre
+        personas = len({p["persona"].lower() for p in items})
+        context = {"nombre": first["persona"] if personas == 1 else "", "personas": personas,
+                   "item": first, "items": items}
+        message = {
+            "channel": channel,
+            "to": first["email"] if channel == "email" else first["celular"],
+            "keys": [(p["id"], p["especializacion"], p["fecha_vencimiento"], p["days_before"], channel) for p in items],
+        }
+        if channel == "email":
+            kind = "email" if len(items) == 1 else "digest"
+            message["subject"] = templates[f"{kind}_subject.txt"].render(context).strip()
+            message["body"] = templates[f"{kind}_body.txt"].render(context)
+        else:
+            message["subject"] = None
+            message["body"] = templates["sms.txt"].render(context).strip()
+            message["encoding"], message["segments"] = sms_segments(message["body"])
+        messages.append(message)
+
+    sms = [m for m in messages if m["channel"] == "sms"]
+    if sms:
+        # Cada segmento se cobra como un SMS: se informa el costo antes de enviar
+        max_segments = int(os.getenv("SMS_MAX_SEGMENTS", "3"))
+        print(f"✓ {len(sms)} SMS preparados: {sum(m['segments'] for m in sms)} segmentos en total")
+        for m in sms:
+            if m["segments"] > max_segments:
+                print(f"⚠ SMS a {m['to']} ocupa {m['segments']} segmentos ({m['encoding']}), más de SMS_MAX_SEGMENTS={max_segments}")
+    return messages
+
+def recipient_key(p):
+    """Canal y destinatario normalizado (email en minúsculas, celular solo con dígitos y +)"""
+    if p["channel"] == "email":
+        return "email", p["email"].strip().lower()
+    return "sms", re.sub(r"[^\d+]", "", p["celular"])
+
+def build_messages(rows, digest=False, templates=None):
+    """
+    Arma los mensajes a enviar a partir de pending_notifications.
+    En modo resumen (digest) agrupa por destinatario y canal: un solo mensaje con todas
+    sus especializaciones, pero cada una conserva su clave para registrarla en notifications.
+    """
+    groups = OrderedDict()
+    for p in rows:
+        group = recipient_key(p) if digest else (p["channel"], p["id"])
+        groups.setdefault(group, []).append(p)
+
+    if templates is None:
+        templates = load_message_templates()
+    return render_messages([(channel, items) for (channel, _), items in groups.items()], templates)
+
+def send_alerts(conn, rows, digest=False):
+    """Renderiza y envía las alertas de `rows`, registrando enviados y fallidos. Retorna (enviados, errores)"""
+    batch_size = int(os.getenv("NOTIFICATIONS_BATCH_SIZE", "500"))
+    sent_keys = []
+    failed = []
+
+    def on_sent(message):
+        # Se ejecuta en este hilo: cada envío exitoso se registra una única vez
+        sent_keys.extend(message["keys"])
+        if len(sent_keys) >= batch_size:
+            mark_sent_many(conn, sent_keys)
+            sent_keys.clear()
+
+    def on_error(message, error):
+        failed.append((message, error))
+
+    try:
+        messages = build_messages(rows, digest=digest)
+
+        # ALERT_MODE=async envía todo desde un event loop en lugar de pools de hilos
+        if os.getenv("ALERT_MODE", "threads").strip().lower() == "async":
+            return asyncio.run(dispatch_messages_async(messages, on_sent=on_sent, on_error=on_error))
+        return dispatch_messages(messages, on_sent=on_sent, on_error=on_error)
+    finally:
+        mark_sent_many(conn, sent_keys)
+        # Los envíos fallidos quedan en el outbox para reintentarse con backoff
+        enqueue_failed(conn, failed)
+
+def shard_rows(rows, shards):
+    """
+    Reparte las alertas en `shards` grupos según un hash estable (crc32) del destinatario,
+    así un mismo resumen (digest) nunca queda dividido entre dos procesos.
+    """
+    parts = [[] for _ in range(shards)]
+    for p in rows:
+        channel, to = recipient_key(p)
+        parts[zlib.crc32(f"{channel}:{to}".encode("utf-8")) % shards].append(p)
+    return [part for part in parts if part]
+
+def _run_shard(rows, digest, shares):
+    # Se ejecuta en un proceso del pool: conexión y sesiones SMTP/Twilio propias,
+    # con su parte de los límites de envío
+    set_send_share(shares)
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM people")
-    people = cur.fetchall()
+    try:
+        return send_alerts(conn, rows, digest)
+    finally:
+        conn.close()
 
-    sent_count = 0
-    errors = 0
+def recover_failed_shards(dates, lookback, digest, failed_parts):
+    """
+    Pasa al outbox las alertas de los shards que fallaron (proceso caído, error al renderizar)
+    que no quedaron registradas ni como enviadas ni en el outbox. Sin esto se perderían:
+    con ALERT_CATCHUP_DAYS=0 el chequeo de mañana ya no busca los umbrales de hoy.
+    """
+    conn = get_db()
+    try:
+        pending = {(p["id"], p["channel"]): p for p in pending_notifications(conn, dates, lookback)}
+        failed = []
+        for part, error in failed_parts:
+            rows = [pending[key] for key in ((p["id"], p["channel"]) for p in part) if key in pending]
+            if rows:
+                failed += [(message, error) for message in build_messages(rows, digest=digest)]
+        enqueue_failed(conn, failed)
+    finally:
+        release_db()
+
+def run_alert_check(wait=0):
+    tzname = os.getenv("TIMEZONE", "America/Bogota")
+    alerts = get_alert_days()
+    if not alerts:
+        return 0, 0
+
+    # Solo se consideran las alertas cuyo día en alert_schedule es hoy;
+    # ALERT_CATCHUP_DAYS recupera los avisos que no salieron en los últimos días
+    lookback = max(0, int(os.getenv("ALERT_CATCHUP_DAYS", "0")))
+    dates = DateContext(tzname)
+    digest = os.getenv("ALERT_DIGEST", "0").strip().lower() in ("1", "true", "si", "sí")
+    shards = max(1, int(os.getenv("ALERT_SHARDS", "1")))
+
+    # Un solo envío a la vez (scheduler, /run-check y outbox), también entre hilos del mismo
+    # proceso: cada ejecución es dueña del lock con su propio identificador
+    run_owner = f"{lease_owner()}:{uuid.uuid4().hex}"
+    if not hold_send_lease(run_owner, wait):
+        print("⚠ Ya hay un envío en curso (chequeo o reintentos del outbox); se omite esta ejecución")
+        return None
 
-    for p in people:
-        d = days_left(p["fecha_vencimiento"], tzname)
-        if d is None:
-            continue
-        if d not in alerts:
-            continue
+    try:
+        conn = get_db()
+        try:
+            sync_alert_thresholds(conn, alerts)
+            rows = pending_notifications(conn, dates, lookback)
+            if shards == 1 or len(rows) < 2:
+                return send_alerts(conn, rows, digest)
+            rows = [dict(r) for r in rows]
+        finally:
+            release_db()
+
+        # ALERT_SHARDS > 1: cada parte se renderiza y envía en su propio proceso. Cada
+        # proceso abre al menos una conexión SMTP, así que no se usan más que SMTP_POOL_SIZE
+        pool_size = int(os.getenv("SMTP_POOL_SIZE", "2"))
+        if shards > pool_size and any(r["channel"] == "email" for r in rows):
+            print(f"⚠ ALERT_SHARDS={shards} supera SMTP_POOL_SIZE={pool_size}; se usan {pool_size} procesos")
+            shards = max(1, pool_size)
+        parts = shard_rows(rows, shards)
+        sent_count = errors = 0
+        failed_parts = []
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=len(parts), mp_context=ctx) as pool:
+            futures = {pool.submit(_run_shard, part, digest, len(parts)): part for part in parts}
+            for future in as_completed(futures):
+                try:
+                    sent, err = future.result()
+                except Exception as e:
+                    print(f"✗ Error en un shard del chequeo: {e!r}")
+                    failed_parts.append((futures[future], e))
+                    sent, err = 0, len(futures[future])
+                sent_count += sent
+                errors += err
+        if failed_parts:
+            recover_failed_shards(dates, lookback, digest, failed_parts)
+        print(f"✓ Chequeo en {len(parts)} procesos: {sent_count} enviados, {errors} errores")
+        return sent_count, errors
+    finally:
+        drop_lease(SEND_LEASE, run_owner)
+
+def scheduled_alert_check():
+    """Chequeo diario: si el outbox está enviando, espera hasta SEND_LEASE_WAIT segundos a que termine"""
+    return run_alert_check(wait=int(os.getenv("SEND_LEASE_WAIT", "900")))
+
+# ============ COLA DE REINTENTOS (OUTBOX) ============
+def _utc_timestamp(seconds_from_now=0):
+    """Marca de tiempo UTC en el mismo formato que CURRENT_TIMESTAMP de SQLite"""
+    when = dt.datetime.utcnow() + dt.timedelta(seconds=seconds_from_now)
+    return when.strftime("%Y-%m-%d %H:%M:%S")
+
+def retry_delay(attempts):
+    """
+    Segundos de espera antes del siguiente intento: backoff exponencial
+    (OUTBOX_BASE_DELAY · 2^(intentos-1), tope OUTBOX_MAX_DELAY) con jitter,
+    para que los reintentos no lleguen todos juntos al proveedor.
+    """
+    base = float(os.getenv("OUTBOX_BASE_DELAY", "60"))
+    cap = float(os.getenv("OUTBOX_MAX_DELAY", "3600"))
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def enqueue_failed(conn, failed):
+    """
+    Guarda en el outbox los mensajes cuyo primer envío falló, en una sola transacción.
+    El texto guardado es el del primer intento; drain_outbox lo vuelve a renderizar.
+    """
+    if not failed:
+        return
+    with conn:
+        for message, error in failed:
+            cur = conn.execute("""
+                INSERT INTO outbox (channel, recipient, subject, body, status, attempts, next_attempt_at, last_error)
+                VALUES (?, ?, ?, ?, 'pending', 1, ?, ?)
+            """, (message["channel"], message["to"], message.get("subject"), message["body"],
+                  _utc_timestamp(retry_delay(1)), str(error)[:500]))
+            conn.executemany("""
+                INSERT INTO outbox_items (outbox_id, person_id, especializacion, fecha_vencimiento, days_before, channel)
+                VALUES (?,?,?,?,?,?)
+            """, [(cur.lastrowid,) + tuple(key) for key in message["keys"]])
+    print(f"⚠ {len(failed)} mensajes pendientes de reintento en el outbox")
+
+def claim_outbox(conn, limit):
+    """
+    Toma los mensajes vencidos del outbox y los pasa a 'sending' dentro de una
+    transacción IMMEDIATE, para que dos drenados simultáneos no envíen lo mismo.
+    """
+    now = _utc_timestamp()
+    # Un 'sending' que no se cerró (proceso caído a mitad de envío) vuelve a la cola
+    stale = _utc_timestamp(-int(os.getenv("OUTBOX_SENDING_TIMEOUT", "900")))
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("""
+            UPDATE outbox SET status = 'pending', updated_at = ?
+            WHERE status = 'sending' AND updated_at < ?
+        """, (now, stale))
+        rows = conn.execute("""
+            SELECT * FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at
+            LIMIT ?
+        """, (now, limit)).fetchall()
+        if rows:
+            conn.executemany("UPDATE outbox SET status = 'sending', updated_at = ? WHERE id = ?",
+                             [(now, r["id"]) for r in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return rows
+
+def drain_outbox():
+    """Reintenta los mensajes vencidos del outbox; lo ejecuta el scheduler cada OUTBOX_INTERVAL segundos"""
+    owner = f"{lease_owner()}:{uuid.uuid4().hex}"
+    if not hold_send_lease(owner):
+        # Hay un chequeo enviando: el outbox se revisa en la siguiente vuelta
+        return 0, 0
+    try:
+        return _drain_outbox()
+    finally:
+        drop_lease(SEND_LEASE, owner)
 
-        fecha_v = p["fecha_vencimiento"]
-        nombre = f'{p["nombre"]} {p["apellido"]}'.strip()
-        esp = p["especializacion"]
+def _drain_outbox():
+    max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+    conn = get_db()
+    sent_ids, failures, cancelled = [], [], []
+    sent_count = errors = 0
 
-        msg = (
-            f"Hola {nombre}.\n\n"
-            f"Tu especialización: {esp}\n"
-            f"Vence el: {fecha_v} (faltan {d} días).\n\n"
-            f"Te recomendamos programar el reentrenamiento con anticipación.\n\n"
-            f"Saludos,\nSistema de Alerta Temprana"
+    try:
+        rows = claim_outbox(conn, int(os.getenv("OUTBOX_BATCH", "200")))
+        if not rows:
+            return 0, 0
+
+        # Cada mensaje se vuelve a renderizar con la fecha de hoy a partir de las notificaciones
+        # que cubre: un reintento días después no repite los "faltan N días" del primer intento.
+        # Se omiten las de personas borradas, sin contacto o cuya especialización o fecha cambió.
+        dates = DateContext()
+        items = {}
+        placeholders = ",".join("?" * len(rows))
+        for item in conn.execute(f"""
+            SELECT oi.outbox_id, p.*,
+                   CAST(julianday(p.fecha_vencimiento) - julianday(?) AS INTEGER) AS days_left,
+                   oi.days_before, oi.channel
+            FROM outbox_items oi
+            JOIN people p ON p.id = oi.person_id AND p.especializacion = oi.especializacion
+                         AND p.fecha_vencimiento = oi.fecha_vencimiento
+            WHERE oi.outbox_id IN ({placeholders})
+              AND ((oi.channel = 'email' AND COALESCE(p.email, '') <> '')
+                   OR (oi.channel = 'sms' AND COALESCE(p.celular, '') <> ''))
+        """, [dates.iso] + [r["id"] for r in rows]):
+            items.setdefault(item["outbox_id"], []).append(item)
+
+        live = [r for r in rows if r["id"] in items]
+        cancelled = [r["id"] for r in rows if r["id"] not in items]
+        messages = render_messages([(r["channel"], items[r["id"]]) for r in live], load_message_templates())
+        for r, message in zip(live, messages):
+            message.update(id=r["id"], attempts=r["attempts"])
+
+        sent_count, errors = dispatch_messages(
+            messages,
+            on_sent=sent_ids.append,
+            on_error=lambda message, error: failures.append((message, error)),
         )
-        subject = f"[Alerta] Vencimiento de especialización en {d} días - {nombre}"
-
-        # Email
-        if p["email"]:
-            try:
-                if not already_sent(conn, p["id"], esp, fecha_v, d, "email"):
-                    send_email(p["email"], subject, msg)
-                    mark_sent(conn, p["id"], esp, fecha_v, d, "email")
-                    sent_count += 1
-            except Exception as e:
-                print(f"Error enviando email: {e}")
-                errors += 1
-
-        # SMS
-        if p["celular"]:
-            try:
-                if not already_sent(conn, p["id"], esp, fecha_v, d, "sms"):
-                    send_sms(p["celular"], msg)
-                    mark_sent(conn, p["id"], esp, fecha_v, d, "sms")
-                    sent_count += 1
-            except Exception as e:
-                print(f"Error enviando SMS: {e}")
-                errors += 1
-
-    conn.close()
+    finally:
+        now = _utc_timestamp()
+        with conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO notifications (person_id, especializacion, fecha_vencimiento, days_before, channel)
+                VALUES (?,?,?,?,?)
+            """, [k for m in sent_ids for k in m["keys"]])
+            conn.executemany("UPDATE outbox SET status = 'sent', updated_at = ? WHERE id = ?",
+                             [(now, m["id"]) for m in sent_ids])
+            conn.executemany("UPDATE outbox SET status = 'cancelled', updated_at = ? WHERE id = ?",
+                             [(now, outbox_id) for outbox_id in cancelled])
+            for message, error in failures:
+                attempts = message["attempts"] + 1
+                status = "failed" if attempts >= max_attempts else "pending"
+                conn.execute("""
+                    UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+                    WHERE id = ?
+                """, (status, attempts, _utc_timestamp(retry_delay(attempts)), str(error)[:500], now, message["id"]))
+        release_db()
+
+    if sent_count or errors:
+        print(f"✓ Outbox: {sent_count} reintentos enviados, {errors} fallidos")
     return sent_count, errors
 
+def outbox_counts(conn):
+    """Mensajes del outbox agrupados por estado"""
+    counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0, "cancelled": 0}
+    for row in conn.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status"):
+        counts[row["status"]] = row["n"]
+    return counts
+
+# ============ IMPORTACIONES EN SEGUNDO PLANO ============
+_import_executor = None
+_import_executor_lock = threading.Lock()
+
+def get_import_executor():
+    """Pool de hilos de las importaciones, creado con la primera carga"""
+    global _import_executor
+    with _import_executor_lock:
+        if _import_executor is None:
+            _import_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMPORT_WORKERS", "1")),
+                                                  thread_name_prefix="import")
+        return _import_executor
+
+def run_import_job(job_id, path):
+    """Carga un Excel subido y va guardando el progreso y las filas rechazadas en la base"""
+    batch_size = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+    conn = get_db()
+    counts = {"skipped": 0, "failed": 0}
+    rejects = []
+
+    def on_skip(row_number):
+        counts["skipped"] += 1
+
+    def on_reject(row_number, reason, values):
+        counts["failed"] += 1
+        rejects.append((job_id, row_number, reason, json.dumps(values, ensure_ascii=False, default=str)))
+
+    def on_batch(loaded):
+        # Se llama con el lote ya confirmado: el progreso queda visible para /imports/<id>
+        conn.executemany("""
+            INSERT INTO import_rejects (job_id, row_number, reason, data) VALUES (?,?,?,?)
+        """, rejects)
+        rejects.clear()
+        conn.execute("""
+            UPDATE import_jobs SET processed=?, inserted=?, updated=?, unchanged=?, duplicates=?, skipped=?, failed=?
+            WHERE id=?
+        """, (loaded["processed"], loaded["inserted"], loaded["updated"], loaded["unchanged"],
+              loaded["duplicates"], counts["skipped"], counts["failed"], job_id))
+        conn.commit()
+        invalidate_dashboard_stats()
+
+    try:
+        conn.execute("UPDATE import_jobs SET status='running' WHERE id=?", (job_id,))
+        conn.commit()
+        people = iter_people_from_excel(path, on_skip=on_skip, on_reject=on_reject)
+        loaded, rate = bulk_upsert_people(conn, iter_chunks(people, batch_size), on_batch=on_batch)
+        on_batch(loaded)
+        conn.execute("UPDATE import_jobs SET status='done', rate=?, finished_at=CURRENT_TIMESTAMP WHERE id=?",
+                     (rate, job_id))
+        conn.commit()
+    except Exception as e:
+        print(f"Error en la importación {job_id}: {e}")
+        conn.rollback()
+        conn.execute("UPDATE import_jobs SET status='error', error=?, finished_at=CURRENT_TIMESTAMP WHERE id=?",
+                     (str(e), job_id))
+        conn.commit()
+    finally:
+        # Las importaciones son esporádicas: el hilo no guarda la conexión abierta entre cargas
+        close_db()
+
 # ============ APP FLASK ============
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "dev-key-change-me")
 
-@app.before_first_request
-def _startup():
+def startup():
+    """Esquema, migraciones y calendario de alertas al día, una sola vez al arrancar el proceso"""
     init_db()
+    conn = get_conn()
+    sync_alert_thresholds(conn, get_alert_days())
+    conn.close()
+
+def _is_shard_worker():
+    # Los procesos de ALERT_SHARDS (spawn) importan este módulo al arrancar, con _inheriting
+    # activo mientras cargan el módulo principal, y después para ejecutar _run_shard
+    process = multiprocessing.current_process()
+    return multiprocessing.parent_process() is not None or getattr(process, "_inheriting", False)
+
+# En los procesos de ALERT_SHARDS no se repite: la base ya la preparó el proceso principal
+if not _is_shard_worker():
+    startup()
+
+@app.teardown_appcontext
+def _release_db(exc):
+    release_db()
 
 # ============ AUTENTICACIÓN ============
 @app.route("/login", methods=["GET", "POST"])
@@ -172,11 +807,10 @@ def login():
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "").strip()
 
-        conn = get_conn()
+        conn = get_db()
         cur = conn.cursor()
         cur.execute("SELECT * FROM users WHERE username=?", (username,))
         user = cur.fetchone()
-        conn.close()
 
         if user and check_password_hash(user["password"], password):
             session['user_id'] = user['id']
@@ -196,55 +830,103 @@ def logout():
     return redirect(url_for('login'))
 
 # ============ PANEL PRINCIPAL ============
+PAGE_SIZES = (25, 50, 100, 200)
+
+def parse_cursor(raw: str, ranked: bool = False):
+    """
+    Cursor de paginación 'valor|id' -> (valor, id), o None si no es válido.
+    El valor es la fecha de vencimiento, o el rank de FTS5 en las búsquedas.
+    """
+    value, _, pid = (raw or "").partition("|")
+    try:
+        value = float(value) if ranked else dt.date.fromisoformat(value).isoformat()
+        return value, int(pid)
+    except ValueError:
+        return None
+
+def fts_query(q: str):
+    """Convierte el texto buscado en una consulta FTS5 de prefijos: 'per jua' -> '"per"* "jua"*'"""
+    return " ".join(f'"{token}"*' for token in re.findall(r"\w+", q))
+
 @app.route("/")
 @login_required
 def index():
-    tzname = os.getenv("TIMEZONE", "America/Bogota")
     q = (request.args.get("q") or "").strip().lower()
     filtro = (request.args.get("filtro") or "").strip()
+    per_page = request.args.get("per_page", type=int)
+    if per_page not in PAGE_SIZES:
+        per_page = 50
+
+    dates = request_dates()
+    limite_proximo = dates.shift(30)
+
+    conn = get_db()
+    match = fts_query(q) if q and fts_enabled(conn) else ""
+
+    # Búsqueda: índice FTS5 ordenado por relevancia; sin búsqueda, por fecha de vencimiento
+    source = "people p"
+    sort_col = "p.fecha_vencimiento"
+    where = []
+    params = []
+    if match:
+        source = "people_fts JOIN people p ON p.id = people_fts.rowid"
+        sort_col = "people_fts.rank"
+        where.append("people_fts MATCH ?")
+        params.append(match)
+    elif q:
+        escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        # Sin FTS5: LIKE sobre el texto en minúsculas (también las letras con tilde: "PÉREZ" ~ "pérez")
+        where.append("unicode_lower(p.nombre || ' ' || p.apellido || ' ' || COALESCE(p.empresa, '') || ' ' || p.especializacion) LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+    if filtro == "proximo":
+        where.append("p.fecha_vencimiento BETWEEN ? AND ?")
+        params += [dates.iso, limite_proximo]
+    elif filtro == "vencido":
+        where.append("p.fecha_vencimiento < ?")
+        params.append(dates.iso)
+
+    # Paginación por cursor (keyset) sobre (orden, id)
+    after = parse_cursor(request.args.get("after"), ranked=bool(match))
+    before = None if after else parse_cursor(request.args.get("before"), ranked=bool(match))
+    order = "ASC"
+    if after:
+        where.append(f"({sort_col}, p.id) > (?, ?)")
+        params += list(after)
+    elif before:
+        where.append(f"({sort_col}, p.id) < (?, ?)")
+        params += list(before)
+        order = "DESC"
 
-    conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM people ORDER BY fecha_vencimiento ASC")
+    cur.execute(f"""
+        SELECT p.*, {sort_col} AS sort_key FROM {source}
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {sort_col} {order}, p.id {order}
+        LIMIT ?
+    """, params + [per_page + 1])
     rows = cur.fetchall()
-    conn.close()
+
+    stats = get_dashboard_stats(conn, dates)
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
 
     people = []
-    proximo_count = 0
-    vencido_count = 0
-    
-    for p in rows:
-        dias = days_left(p["fecha_vencimiento"], tzname)
+    for p, dias in zip(rows, dates.days_left_many([p["fecha_vencimiento"] for p in rows])):
         item = dict(p)
         item["dias"] = dias
-        
-        # Contadores para estadísticas
-        if dias is not None:
-            if 0 <= dias <= 30:
-                proximo_count += 1
-            elif dias < 0:
-                vencido_count += 1
-
-        hay = " ".join([
-            item.get("nombre",""), item.get("apellido",""),
-            item.get("empresa","") or "", item.get("especializacion","")
-        ]).lower()
-        if q and q not in hay:
-            continue
-        if filtro == "proximo" and (dias is None or dias > 30 or dias < 0):
-            continue
-        if filtro == "vencido" and (dias is None or dias >= 0):
-            continue
-
         people.append(item)
 
-    stats = {
-        'total': len(rows),
-        'proximo': proximo_count,
-        'vencido': vencido_count
-    }
+    has_next = has_more if not before else True
+    has_prev = bool(after) or (bool(before) and has_more)
+    next_cursor = f'{rows[-1]["sort_key"]}|{rows[-1]["id"]}' if rows and has_next else None
+    prev_cursor = f'{rows[0]["sort_key"]}|{rows[0]["id"]}' if rows and has_prev else None
 
-    return render_template("index.html", people=people, q=q, filtro=filtro, stats=stats)
+    return render_template("index.html", people=people, q=q, filtro=filtro, stats=stats,
+                           per_page=per_page, page_sizes=PAGE_SIZES,
+                           next_cursor=next_cursor, prev_cursor=prev_cursor)
 
 # ============ GESTIÓN DE PERSONAS ============
 @app.route("/add", methods=["GET", "POST"])
@@ -272,15 +954,19 @@ def add():
         data["fecha_expedicion"] = fe.isoformat() if fe else None
         data["fecha_vencimiento"] = fv.isoformat()
 
-        conn = get_conn()
+        conn = get_db()
         cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO people (nombre, apellido, especializacion, fecha_expedicion, fecha_vencimiento, escuela, empresa, email, celular)
-            VALUES (?,?,?,?,?,?,?,?,?)
-        """, (data["nombre"], data["apellido"], data["especializacion"], data["fecha_expedicion"], data["fecha_vencimiento"],
-              data["escuela"], data["empresa"], data["email"], data["celular"]))
+        try:
+            cur.execute("""
+                INSERT INTO people (nombre, apellido, especializacion, fecha_expedicion, fecha_vencimiento, escuela, empresa, email, celular)
+                VALUES (?,?,?,?,?,?,?,?,?)
+            """, (data["nombre"], data["apellido"], data["especializacion"], data["fecha_expedicion"], data["fecha_vencimiento"],
+                  data["escuela"], data["empresa"], data["email"], data["celular"]))
+        except sqlite3.IntegrityError:
+            flash("Ya existe esa persona con la misma especialización y email.", "warn")
+            return redirect(url_for("add"))
         conn.commit()
-        conn.close()
+        invalidate_dashboard_stats()
         flash("Persona guardada exitosamente.", "ok")
         return redirect(url_for("index"))
 
@@ -289,13 +975,12 @@ def add():
 @app.route("/edit/<int:pid>", methods=["GET", "POST"])
 @admin_required
 def edit(pid):
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("SELECT * FROM people WHERE id=?", (pid,))
     person = cur.fetchone()
 
     if not person:
-        conn.close()
         flash("No existe esa persona.", "warn")
         return redirect(url_for("index"))
 
@@ -314,7 +999,6 @@ def edit(pid):
 
         fv = parse_iso_date(data["fecha_vencimiento"])
         if not fv:
-            conn.close()
             flash("Fecha de vencimiento inválida. Usa YYYY-MM-DD o dd/mm/yyyy", "warn")
             return redirect(url_for("edit", pid=pid))
 
@@ -322,28 +1006,31 @@ def edit(pid):
         data["fecha_expedicion"] = fe.isoformat() if fe else None
         data["fecha_vencimiento"] = fv.isoformat()
 
-        cur.execute("""
-            UPDATE people
-            SET nombre=?, apellido=?, especializacion=?, fecha_expedicion=?, fecha_vencimiento=?, escuela=?, empresa=?, email=?, celular=?
-            WHERE id=?
-        """, (data["nombre"], data["apellido"], data["especializacion"], data["fecha_expedicion"], data["fecha_vencimiento"],
-              data["escuela"], data["empresa"], data["email"], data["celular"], pid))
+        try:
+            cur.execute("""
+                UPDATE people
+                SET nombre=?, apellido=?, especializacion=?, fecha_expedicion=?, fecha_vencimiento=?, escuela=?, empresa=?, email=?, celular=?
+                WHERE id=?
+            """, (data["nombre"], data["apellido"], data["especializacion"], data["fecha_expedicion"], data["fecha_vencimiento"],
+                  data["escuela"], data["empresa"], data["email"], data["celular"], pid))
+        except sqlite3.IntegrityError:
+            flash("Ya existe esa persona con la misma especialización y email.", "warn")
+            return redirect(url_for("edit", pid=pid))
         conn.commit()
-        conn.close()
+        invalidate_dashboard_stats()
         flash("Cambios guardados exitosamente.", "ok")
         return redirect(url_for("index"))
 
-    conn.close()
     return render_template("add_edit.html", person=dict(person))
 
 @app.route("/delete/<int:pid>")
 @admin_required
 def delete(pid):
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("DELETE FROM people WHERE id=?", (pid,))
     conn.commit()
-    conn.close()
+    invalidate_dashboard_stats()
     flash("Persona eliminada exitosamente.", "ok")
     return redirect(url_for("index"))
 
@@ -357,41 +1044,64 @@ def upload():
             flash("Sube un archivo .xlsx válido", "warn")
             return redirect(url_for("upload"))
 
-        path = UPLOAD_DIR / f.filename
+        filename = secure_filename(f.filename) or "importacion.xlsx"
+        path = UPLOAD_DIR / f"{uuid.uuid4().hex}_{filename}"
         f.save(path)
 
-        try:
-            people = load_people_from_excel(str(path))
-        except Exception as e:
-            flash(f"Error leyendo el Excel: {e}", "warn")
-            return redirect(url_for("upload"))
-
-        conn = get_conn()
+        # La carga corre en segundo plano; el admin sigue el progreso en /imports/<id>
+        conn = get_db()
         cur = conn.cursor()
-        inserted = 0
-        for p in people:
-            cur.execute("""
-                INSERT INTO people (nombre, apellido, especializacion, fecha_expedicion, fecha_vencimiento, escuela, empresa, email, celular)
-                VALUES (?,?,?,?,?,?,?,?,?)
-            """, (p["nombre"], p["apellido"], p["especializacion"], p["fecha_expedicion"], p["fecha_vencimiento"],
-                  p.get("escuela",""), p.get("empresa",""), p.get("email",""), p.get("celular","")))
-            inserted += 1
+        cur.execute("INSERT INTO import_jobs (filename, created_by) VALUES (?,?)", (filename, session['user_id']))
+        job_id = cur.lastrowid
         conn.commit()
-        conn.close()
-        flash(f"Importación exitosa. {inserted} registros cargados.", "ok")
-        return redirect(url_for("index"))
+
+        get_import_executor().submit(run_import_job, job_id, str(path))
+        flash("Archivo recibido. La importación se está procesando.", "ok")
+        return redirect(url_for("import_status", job_id=job_id))
 
     return render_template("upload.html")
 
+@app.route("/imports/<int:job_id>")
+@admin_required
+def import_status(job_id):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM import_jobs WHERE id=?", (job_id,))
+    job = cur.fetchone()
+    if not job:
+        flash("No existe esa importación.", "warn")
+        return redirect(url_for("upload"))
+
+    cur.execute("""
+        SELECT row_number, reason, data FROM import_rejects
+        WHERE job_id=? ORDER BY row_number LIMIT 500
+    """, (job_id,))
+    rejects = [dict(r, data=json.loads(r["data"] or "{}")) for r in cur.fetchall()]
+    return render_template("import_status.html", job=dict(job), rejects=rejects)
+
+@app.route("/imports/<int:job_id>/status")
+@admin_required
+def import_status_json(job_id):
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, filename, status, processed, inserted, updated, unchanged, duplicates, skipped, failed,
+               rate, error, created_at, finished_at
+        FROM import_jobs WHERE id=?
+    """, (job_id,))
+    job = cur.fetchone()
+    if not job:
+        abort(404)
+    return jsonify(dict(job))
+
 # ============ GESTIÓN DE USUARIOS ============
 @app.route("/users")
 @admin_required
 def users():
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("SELECT id, username, email, role FROM users ORDER BY role, username")
     users_list = cur.fetchall()
-    conn.close()
     return render_template("users.html", users=users_list)
 
 @app.route("/users/add", methods=["GET", "POST"])
@@ -407,13 +1117,12 @@ def add_user():
             flash("Usuario y contraseña son obligatorios.", "warn")
             return redirect(url_for("add_user"))
 
-        conn = get_conn()
+        conn = get_db()
         cur = conn.cursor()
         
         # Verificar si el usuario ya existe
         cur.execute("SELECT id FROM users WHERE username=?", (username,))
         if cur.fetchone():
-            conn.close()
             flash("El nombre de usuario ya existe.", "warn")
             return redirect(url_for("add_user"))
 
@@ -423,7 +1132,6 @@ def add_user():
             VALUES (?,?,?,?)
         """, (username, hashed, email, role))
         conn.commit()
-        conn.close()
         flash(f"Usuario '{username}' creado exitosamente.", "ok")
         return redirect(url_for("users"))
 
@@ -432,13 +1140,12 @@ def add_user():
 @app.route("/users/edit/<int:uid>", methods=["GET", "POST"])
 @admin_required
 def edit_user(uid):
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("SELECT * FROM users WHERE id=?", (uid,))
     user = cur.fetchone()
 
     if not user:
-        conn.close()
         flash("Usuario no encontrado.", "warn")
         return redirect(url_for("users"))
 
@@ -461,11 +1168,10 @@ def edit_user(uid):
             """, (username, email, role, uid))
         
         conn.commit()
-        conn.close()
+        invalidate_user_role(uid)
         flash("Usuario actualizado exitosamente.", "ok")
         return redirect(url_for("users"))
 
-    conn.close()
     return render_template("add_edit_user.html", user=dict(user))
 
 @app.route("/users/delete/<int:uid>")
@@ -475,11 +1181,11 @@ def delete_user(uid):
         flash("No puedes eliminar tu propio usuario.", "warn")
         return redirect(url_for("users"))
 
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("DELETE FROM users WHERE id=?", (uid,))
     conn.commit()
-    conn.close()
+    invalidate_user_role(uid)
     flash("Usuario eliminado exitosamente.", "ok")
     return redirect(url_for("users"))
 
@@ -490,32 +1196,89 @@ def settings():
     tz = os.getenv("TIMEZONE", "America/Bogota")
     alert_days = ",".join(map(str, get_alert_days()))
     
-    conn = get_conn()
+    conn = get_db()
     cur = conn.cursor()
     cur.execute("SELECT COUNT(*) as total FROM notifications")
     notif_count = cur.fetchone()['total']
-    conn.close()
+    outbox = outbox_counts(conn)
+    forecast = upcoming_alert_load(conn, request_dates(), int(os.getenv("FORECAST_DAYS", "14")))
     
-    return render_template("settings.html", tz=tz, alert_days=alert_days, notif_count=notif_count)
+    return render_template("settings.html", tz=tz, alert_days=alert_days, notif_count=notif_count, outbox=outbox,
+                           forecast=forecast)
 
 @app.route("/run-check")
 @admin_required
 def run_check():
-    sent, err = run_alert_check()
+    result = run_alert_check()
+    if result is None:
+        flash("Ya hay un envío en curso (chequeo o reintentos). Inténtalo de nuevo cuando termine.", "warn")
+        return redirect(url_for("index"))
+    sent, err = result
     flash(f"Chequeo ejecutado. Alertas enviadas: {sent}. Errores: {err}.", "ok" if err == 0 else "warn")
     return redirect(url_for("index"))
 
 # ============ SCHEDULER ============
+# Con varios procesos (workers de gunicorn en un mismo servidor) todos arrancan el scheduler,
+# pero solo el que tiene el lock "scheduler" ejecuta las tareas. Si el líder muere, su lock
+# vence a los SCHEDULER_LEASE_TTL segundos y otro proceso lo toma en su siguiente latido.
+_leader = False
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def scheduler_heartbeat():
+    """Renueva (o intenta tomar) el liderazgo del scheduler"""
+    global _leader
+    leader = hold_lease("scheduler", int(os.getenv("SCHEDULER_LEASE_TTL", "90")))
+    if leader and not _leader:
+        print(f"✓ Este proceso ({lease_owner()}) ejecuta las tareas programadas")
+    elif _leader and not leader:
+        print(f"⚠ Este proceso ({lease_owner()}) perdió el liderazgo del scheduler")
+    _leader = leader
+    return leader
+
+def leader_only(job):
+    """La tarea solo se ejecuta en el proceso líder; se comprueba el lock justo antes"""
+    @wraps(job)
+    def wrapper(*args, **kwargs):
+        if not scheduler_heartbeat():
+            return None
+        return job(*args, **kwargs)
+    return wrapper
+
+def _release_leadership():
+    if _leader:
+        drop_lease("scheduler")
+
 def start_scheduler():
+    """Arranca el scheduler de este proceso; si ya estaba en marcha lo devuelve sin duplicarlo"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = _create_scheduler()
+        return _scheduler
+
+def _create_scheduler():
     tzname = os.getenv("TIMEZONE", "America/Bogota")
-    tz = pytz.timezone(tzname)
+    tz = get_timezone(tzname)
     sched = BackgroundScheduler(timezone=tz)
+    sched.add_job(scheduler_heartbeat, "interval", seconds=int(os.getenv("SCHEDULER_HEARTBEAT", "30")),
+                  id="leader_heartbeat", replace_existing=True, max_instances=1, coalesce=True,
+                  next_run_time=dt.datetime.now(tz))
     trigger = CronTrigger(hour=8, minute=0)
-    sched.add_job(run_alert_check, trigger, id="daily_check", replace_existing=True)
+    sched.add_job(leader_only(scheduled_alert_check), trigger, id="daily_check", replace_existing=True)
+    # Reintentos del outbox: una sola ejecución a la vez, sin acumular las perdidas
+    sched.add_job(leader_only(drain_outbox), "interval", seconds=int(os.getenv("OUTBOX_INTERVAL", "60")),
+                  id="drain_outbox", replace_existing=True, max_instances=1, coalesce=True)
     sched.start()
+    # Al apagar el proceso se cede el liderazgo sin esperar a que venza el lock
+    atexit.register(_release_leadership)
     return sched
 
+# gunicorn (u otro servidor WSGI) importa este módulo y nunca pasa por __main__:
+# con SCHEDULER_AUTOSTART=1 cada proceso que lo importa arranca su scheduler
+if os.getenv("SCHEDULER_AUTOSTART", "0").strip().lower() in ("1", "true", "si", "sí") and not _is_shard_worker():
+    start_scheduler()
+
 if __name__ == "__main__":
-    init_db()
     start_scheduler()
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -1,18 +1,458 @@
 import sqlite3
 import os
+import time
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from werkzeug.security import generate_password_hash
 
 APP_DIR = Path(__file__).resolve().parent
 DB_PATH = APP_DIR / "alerta.db"
 
+_local = threading.local()
+
+def _unicode_lower(value):
+    return value.lower() if isinstance(value, str) else value
+
 def get_conn():
-    conn = sqlite3.connect(str(DB_PATH))
+    """
+    Abre una conexión nueva con los ajustes de SQLite de la aplicación:
+    WAL (las lecturas no esperan a las escrituras del chequeo diario), synchronous=NORMAL,
+    busy_timeout (SQLITE_BUSY_TIMEOUT ms) en lugar de "database is locked" y claves foráneas activas.
+    """
+    busy_timeout = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+    conn = sqlite3.connect(str(DB_PATH), timeout=busy_timeout / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={busy_timeout}")
+    conn.execute("PRAGMA foreign_keys=ON")
+    # lower() de SQLite solo convierte ASCII; unicode_lower("PÉREZ") = "pérez", como str.lower()
+    conn.create_function("unicode_lower", 1, _unicode_lower, deterministic=True)
+    return conn
+
+def get_db():
+    """
+    Conexión del hilo actual: se abre y configura una sola vez y se reutiliza en las
+    siguientes peticiones o ejecuciones del scheduler que atienda el mismo hilo.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = get_conn()
+        _local.conn = conn
     return conn
 
+def release_db():
+    """Libera la conexión del hilo al terminar una petición o job (descarta lo no confirmado)"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+def close_db():
+    """Cierra la conexión del hilo actual"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+PEOPLE_COLUMNS = ("nombre", "apellido", "especializacion", "fecha_expedicion", "fecha_vencimiento",
+                  "escuela", "empresa", "email", "celular")
+
+def person_values(p):
+    """Tupla de valores de una persona en el orden de PEOPLE_COLUMNS"""
+    return (p["nombre"], p["apellido"], p["especializacion"], p.get("fecha_expedicion"), p["fecha_vencimiento"],
+            p.get("escuela", ""), p.get("empresa", ""), p.get("email", ""), p.get("celular", ""))
+
+@contextmanager
+def bulk_load_pragmas(conn):
+    """Ajusta SQLite para cargas masivas (WAL, synchronous=NORMAL, caché grande) y restaura al salir"""
+    cur = conn.cursor()
+    previous = {
+        name: cur.execute(f"PRAGMA {name}").fetchone()[0]
+        for name in ("journal_mode", "synchronous", "temp_store", "cache_size")
+    }
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.execute("PRAGMA cache_size=-65536")
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            try:
+                cur.execute(f"PRAGMA {name}={value}")
+            except sqlite3.OperationalError:
+                # journal_mode no se puede cambiar si otra conexión tiene la base abierta
+                pass
+
+# Clave natural de una persona en las importaciones (respaldada por ux_people_natural_key)
+NATURAL_KEY = "nombre, apellido, especializacion, COALESCE(email, '')"
+
+def _differs(left, right):
+    return " OR ".join(f"{left}.{col} IS NOT {right}.{col}" for col in PEOPLE_COLUMNS)
+
+def bulk_upsert_people(conn, batches, on_batch=None):
+    """
+    Importa personas por lotes usando la clave natural (nombre, apellido, especialización y email):
+    inserta las nuevas, actualiza las que cambiaron y omite las que no cambiaron.
+    Cada lote pasa por una tabla temporal y se aplica con un solo INSERT ... ON CONFLICT.
+    batches: iterable de listas de diccionarios (ver importer.iter_chunks).
+    Si se pasa on_batch(conteos), cada lote se confirma por separado y después
+    se llama on_batch, para poder publicar el progreso de la carga.
+    Retorna (conteos, filas_por_segundo), con conteos: processed, inserted, updated, unchanged
+    y duplicates (filas cuya clave se repite en el archivo, también entre lotes distintos;
+    la persona queda con los datos de la última).
+    """
+    cols = ", ".join(PEOPLE_COLUMNS)
+    key_match = ("p.nombre = s.nombre AND p.apellido = s.apellido AND p.especializacion = s.especializacion "
+                 "AND COALESCE(p.email, '') = COALESCE(s.email, '')")
+    counts = {"processed": 0, "inserted": 0, "updated": 0, "unchanged": 0, "duplicates": 0}
+    start = time.perf_counter()
+    cur = conn.cursor()
+    with bulk_load_pragmas(conn):
+        cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS people_stage ({cols})")
+        # Claves ya cargadas en lotes anteriores de este mismo archivo
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS people_seen (
+                nombre, apellido, especializacion, email,
+                UNIQUE (nombre, apellido, especializacion, email)
+            )
+        """)
+        cur.execute("DELETE FROM people_seen")
+        try:
+            for batch in batches:
+                cur.execute("DELETE FROM people_stage")
+                cur.executemany(f"INSERT INTO people_stage ({cols}) VALUES ({', '.join('?' * len(PEOPLE_COLUMNS))})",
+                                [person_values(p) for p in batch])
+                # Si la clave se repite dentro del archivo gana la última fila
+                cur.execute(f"""
+                    DELETE FROM people_stage
+                    WHERE rowid NOT IN (SELECT MAX(rowid) FROM people_stage GROUP BY {NATURAL_KEY})
+                """)
+                duplicates = cur.rowcount
+                # Una clave que ya vino en un lote anterior también es repetida: se aplica
+                # (gana la última fila) pero ya se contó como insertada, actualizada o sin cambios
+                cur.execute(f"""
+                    SELECT COALESCE(SUM(seen), 0),
+                           COALESCE(SUM(NOT seen AND p.id IS NULL), 0),
+                           COALESCE(SUM(NOT seen AND p.id IS NOT NULL AND ({_differs("p", "s")})), 0)
+                    FROM (
+                        SELECT s.*, EXISTS (
+                            SELECT 1 FROM people_seen k
+                            WHERE k.nombre = s.nombre AND k.apellido = s.apellido
+                              AND k.especializacion = s.especializacion AND k.email = COALESCE(s.email, '')
+                        ) AS seen
+                        FROM people_stage s
+                    ) s
+                    LEFT JOIN people p ON {key_match}
+                """)
+                seen, inserted, updated = cur.fetchone()
+                duplicates += seen
+                cur.execute("""
+                    INSERT OR IGNORE INTO people_seen
+                    SELECT nombre, apellido, especializacion, COALESCE(email, '') FROM people_stage
+                """)
+                cur.execute(f"""
+                    INSERT INTO people ({cols})
+                    SELECT {cols} FROM people_stage WHERE true
+                    ON CONFLICT ({NATURAL_KEY}) DO UPDATE
+                    SET {", ".join(f"{col} = excluded.{col}" for col in PEOPLE_COLUMNS)}
+                    WHERE {_differs("people", "excluded")}
+                """)
+
+                counts["processed"] += len(batch)
+                counts["inserted"] += inserted
+                counts["updated"] += updated
+                counts["duplicates"] += duplicates
+                counts["unchanged"] += len(batch) - duplicates - inserted - updated
+                if on_batch:
+                    conn.commit()
+                    on_batch(dict(counts))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.execute("DROP TABLE IF EXISTS temp.people_stage")
+            cur.execute("DROP TABLE IF EXISTS temp.people_seen")
+    elapsed = time.perf_counter() - start
+    return counts, (counts["processed"] / elapsed if elapsed > 0 else float(counts["processed"]))
+
+def fts_enabled(conn):
+    """True si existe el índice de texto completo people_fts (SQLite compilado con FTS5)"""
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='people_fts'")
+    return cur.fetchone() is not None
+
+def _add_column_if_missing(cur, table, column, definition):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [row["name"] for row in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# ============ MIGRACIONES ============
+# Cada migración lleva la base a la versión indicada (PRAGMA user_version).
+# Se aplican una sola vez, en orden, y deben ser idempotentes porque las bases
+# creadas antes de este sistema ya pueden tener parte del esquema.
+
+def _migration_people_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_people_fecha_vencimiento ON people(fecha_vencimiento)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_people_email ON people(email)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_people_empresa ON people(empresa)")
+    # notifications.person_id ya está cubierto por el índice de su UNIQUE(person_id, ...),
+    # que es el que usa el borrado en cascada; otro índice solo encarecería los inserts.
+
+def _migration_import_jobs(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            processed INTEGER NOT NULL DEFAULT 0,
+            inserted INTEGER NOT NULL DEFAULT 0,
+            updated INTEGER NOT NULL DEFAULT 0,
+            unchanged INTEGER NOT NULL DEFAULT 0,
+            duplicates INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            rate REAL,
+            error TEXT,
+            created_by INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    for column in ("inserted", "updated", "unchanged", "duplicates"):
+        _add_column_if_missing(cur, "import_jobs", column, "INTEGER NOT NULL DEFAULT 0")
+
+    # Filas rechazadas por cada importación
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS import_rejects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            row_number INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            data TEXT,
+            FOREIGN KEY (job_id) REFERENCES import_jobs(id) ON DELETE CASCADE
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_import_rejects_job ON import_rejects(job_id, row_number)")
+
+def _merge_duplicate_people(cur):
+    """
+    Une las personas repetidas por clave natural: se queda la de mayor id, le pasa las
+    notificaciones de las demás y borra el resto. Retorna cuántas borró.
+    """
+    cur.execute("DROP TABLE IF EXISTS temp.people_merge")
+    cur.execute(f"""
+        CREATE TEMP TABLE people_merge AS
+        SELECT p.id AS old_id, k.keep_id
+        FROM people p
+        JOIN (
+            SELECT MAX(id) AS keep_id, nombre, apellido, especializacion, COALESCE(email, '') AS email
+            FROM people GROUP BY {NATURAL_KEY} HAVING COUNT(*) > 1
+        ) k ON p.nombre = k.nombre AND p.apellido = k.apellido AND p.especializacion = k.especializacion
+           AND COALESCE(p.email, '') = k.email AND p.id <> k.keep_id
+    """)
+    merged = cur.execute("SELECT COUNT(*) FROM people_merge").fetchone()[0]
+    if merged:
+        # Las notificaciones que ya existen para la persona que queda se borran en cascada
+        cur.execute("""
+            UPDATE OR IGNORE notifications
+            SET person_id = (SELECT keep_id FROM people_merge WHERE old_id = notifications.person_id)
+            WHERE person_id IN (SELECT old_id FROM people_merge)
+        """)
+        cur.execute("DELETE FROM people WHERE id IN (SELECT old_id FROM people_merge)")
+    cur.execute("DROP TABLE temp.people_merge")
+    return merged
+
+def _migration_natural_key(cur):
+    # Clave natural para que reimportar el mismo Excel actualice en lugar de duplicar
+    merged = _merge_duplicate_people(cur)
+    if merged:
+        print(f"✓ {merged} personas duplicadas unidas con su registro más reciente")
+    cur.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_people_natural_key ON people({NATURAL_KEY})")
+
+def _migration_people_fts(cur):
+    # Búsqueda de texto completo sobre people (sin distinguir tildes: "Pérez" = "perez")
+    try:
+        cur.execute("SAVEPOINT people_fts")
+        cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='people_fts'")
+        created = cur.fetchone() is None
+        cur.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS people_fts USING fts5(
+                nombre, apellido, empresa, especializacion,
+                content='people', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        # Triggers que mantienen el índice sincronizado con people
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS people_fts_ai AFTER INSERT ON people BEGIN
+                INSERT INTO people_fts (rowid, nombre, apellido, empresa, especializacion)
+                VALUES (new.id, new.nombre, new.apellido, new.empresa, new.especializacion);
+            END
+        """)
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS people_fts_ad AFTER DELETE ON people BEGIN
+                INSERT INTO people_fts (people_fts, rowid, nombre, apellido, empresa, especializacion)
+                VALUES ('delete', old.id, old.nombre, old.apellido, old.empresa, old.especializacion);
+            END
+        """)
+        cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS people_fts_au AFTER UPDATE OF nombre, apellido, empresa, especializacion ON people BEGIN
+                INSERT INTO people_fts (people_fts, rowid, nombre, apellido, empresa, especializacion)
+                VALUES ('delete', old.id, old.nombre, old.apellido, old.empresa, old.especializacion);
+                INSERT INTO people_fts (rowid, nombre, apellido, empresa, especializacion)
+                VALUES (new.id, new.nombre, new.apellido, new.empresa, new.especializacion);
+            END
+        """)
+        if created:
+            cur.execute("INSERT INTO people_fts (people_fts) VALUES ('rebuild')")
+        cur.execute("RELEASE people_fts")
+    except sqlite3.OperationalError as e:
+        cur.execute("ROLLBACK TO people_fts")
+        cur.execute("RELEASE people_fts")
+        print(f"⚠ Búsqueda de texto completo no disponible (FTS5): {e}")
+
+def _migration_outbox(cur):
+    # Cola persistente de mensajes fallidos que se reintentan con backoff exponencial
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            subject TEXT,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox(status, next_attempt_at)")
+
+    # Notificaciones que cubre cada mensaje del outbox (varias si es un resumen)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS outbox_items (
+            outbox_id INTEGER NOT NULL,
+            person_id INTEGER NOT NULL,
+            especializacion TEXT NOT NULL,
+            fecha_vencimiento TEXT NOT NULL,
+            days_before INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            FOREIGN KEY (outbox_id) REFERENCES outbox(id) ON DELETE CASCADE,
+            FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+        )
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_items_key
+        ON outbox_items(person_id, especializacion, fecha_vencimiento, days_before, channel)
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_outbox_items_outbox ON outbox_items(outbox_id)")
+
+# Fecha en que vence cada umbral de alerta de una persona (vacía si la fecha no es válida)
+SCHEDULE_DUE_DATE = "date({p}.fecha_vencimiento, printf('%+d days', -t.days_before))"
+
+def _migration_alert_schedule(cur):
+    # Calendario materializado: (persona, umbral) -> día en que toca avisar
+    cur.execute("CREATE TABLE IF NOT EXISTS alert_thresholds (days_before INTEGER PRIMARY KEY)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS alert_schedule (
+            person_id INTEGER NOT NULL,
+            days_before INTEGER NOT NULL,
+            due_date TEXT NOT NULL,
+            PRIMARY KEY (person_id, days_before),
+            FOREIGN KEY (person_id) REFERENCES people(id) ON DELETE CASCADE
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_alert_schedule_due ON alert_schedule(due_date, person_id, days_before)")
+
+    # Triggers que mantienen el calendario al día con people (el borrado va por ON DELETE CASCADE)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS people_schedule_ai AFTER INSERT ON people BEGIN
+            INSERT INTO alert_schedule (person_id, days_before, due_date)
+            SELECT new.id, t.days_before, {SCHEDULE_DUE_DATE.format(p="new")}
+            FROM alert_thresholds t
+            WHERE {SCHEDULE_DUE_DATE.format(p="new")} IS NOT NULL;
+        END
+    """)
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS people_schedule_au AFTER UPDATE OF fecha_vencimiento ON people
+        WHEN new.fecha_vencimiento IS NOT old.fecha_vencimiento BEGIN
+            DELETE FROM alert_schedule WHERE person_id = old.id;
+            INSERT INTO alert_schedule (person_id, days_before, due_date)
+            SELECT new.id, t.days_before, {SCHEDULE_DUE_DATE.format(p="new")}
+            FROM alert_thresholds t
+            WHERE {SCHEDULE_DUE_DATE.format(p="new")} IS NOT NULL;
+        END
+    """)
+
+def _migration_scheduler_leases(cur):
+    # Locks con vencimiento para que un solo proceso ejecute cada tarea programada
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS scheduler_leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+def _migration_users_generation(cur):
+    # Contador que sube con cada cambio de rol o borrado de un usuario, sea cual sea el
+    # proceso que lo haga: las cachés de roles de todos los workers lo comparan
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO cache_generations (name, value) VALUES ('users', 0)")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_generation_au AFTER UPDATE OF role ON users BEGIN
+            UPDATE cache_generations SET value = value + 1 WHERE name = 'users';
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_generation_ad AFTER DELETE ON users BEGIN
+            UPDATE cache_generations SET value = value + 1 WHERE name = 'users';
+        END
+    """)
+
+MIGRATIONS = [
+    (1, "índices de people por vencimiento, email y empresa", _migration_people_indexes),
+    (2, "importaciones en segundo plano", _migration_import_jobs),
+    (3, "clave natural de personas", _migration_natural_key),
+    (4, "búsqueda de texto completo", _migration_people_fts),
+    (5, "cola de reintentos (outbox)", _migration_outbox),
+    (6, "calendario de alertas", _migration_alert_schedule),
+    (7, "locks del scheduler", _migration_scheduler_leases),
+    (8, "generación de usuarios para la caché de roles", _migration_users_generation),
+]
+
+def migrate(conn):
+    """Aplica las migraciones pendientes según PRAGMA user_version, cada una en su transacción"""
+    cur = conn.cursor()
+    for version, description, apply in MIGRATIONS:
+        # BEGIN IMMEDIATE toma el bloqueo de escritura: si varios procesos arrancan a la vez,
+        # solo uno aplica cada migración y los demás la ven ya hecha al releer la versión
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            current = cur.execute("PRAGMA user_version").fetchone()[0]
+            if current >= version:
+                conn.rollback()
+                continue
+            apply(cur)
+            cur.execute(f"PRAGMA user_version={version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"✓ Migración {version} aplicada: {description}")
+
 def init_db():
-    """Inicializa la base de datos con todas las tablas necesarias"""
+    """Crea las tablas base si no existen y aplica las migraciones pendientes"""
     conn = get_conn()
     cur = conn.cursor()
 
@@ -72,5 +512,69 @@ def init_db():
         print("✓ Usuario admin creado (usuario: admin, contraseña: admin123)")
 
     conn.commit()
+    migrate(conn)
     conn.close()
-    print("✓ Base de datos inicializada correctamente")
\ No newline at end of file
+    print("✓ Base de datos inicializada correctamente")
+# ============ CALENDARIO DE ALERTAS ============
+def sync_alert_thresholds(conn, alerts):
+    """
+    Ajusta alert_schedule a los umbrales de ALERT_DAYS: solo calcula las fechas de los
+    umbrales nuevos y borra las de los que ya no están. Retorna True si hubo cambios.
+    """
+    wanted = set(alerts)
+    current = {r[0] for r in conn.execute("SELECT days_before FROM alert_thresholds")}
+    if current == wanted:
+        return False
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Releer dentro de la transacción por si otro proceso ya hizo el cambio
+        current = {r[0] for r in conn.execute("SELECT days_before FROM alert_thresholds")}
+        removed = [(d,) for d in current - wanted]
+        added = [(d,) for d in wanted - current]
+        conn.executemany("DELETE FROM alert_schedule WHERE days_before = ?", removed)
+        conn.executemany("DELETE FROM alert_thresholds WHERE days_before = ?", removed)
+        conn.executemany("INSERT INTO alert_thresholds (days_before) VALUES (?)", added)
+        if added:
+            placeholders = ",".join("?" * len(added))
+            conn.execute(f"""
+                INSERT INTO alert_schedule (person_id, days_before, due_date)
+                SELECT p.id, t.days_before, {SCHEDULE_DUE_DATE.format(p="p")}
+                FROM people p
+                JOIN alert_thresholds t ON t.days_before IN ({placeholders})
+                WHERE {SCHEDULE_DUE_DATE.format(p="p")} IS NOT NULL
+            """, [d for (d,) in added])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if not (removed or added):
+        return False
+    print(f"✓ Calendario de alertas actualizado: umbrales {sorted(wanted, reverse=True)}")
+    return True
+
+# ============ CACHÉS ENTRE PROCESOS ============
+def cache_generation(conn, name):
+    """Valor actual del contador `name` de cache_generations (0 si no existe)"""
+    row = conn.execute("SELECT value FROM cache_generations WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+# ============ LOCKS ENTRE PROCESOS ============
+def acquire_lease(conn, name, owner, ttl):
+    """
+    Toma o renueva el lock `name` para `owner` durante `ttl` segundos, en una sola
+    sentencia atómica: solo gana si el lock está libre, vencido o ya era suyo.
+    """
+    now = time.time()
+    with conn:
+        cur = conn.execute("""
+            INSERT INTO scheduler_leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE scheduler_leases.owner = excluded.owner OR scheduler_leases.expires_at < ?
+        """, (name, owner, now + ttl, now))
+    return cur.rowcount == 1
+
+def release_lease(conn, name, owner):
+    """Libera el lock si todavía pertenece a `owner`"""
+    with conn:
+        conn.execute("DELETE FROM scheduler_leases WHERE name = ? AND owner = ?", (name, owner))
@@ -6,6 +6,12 @@ TIMEZONE=America/Bogota
 # El sistema enviará notificaciones cuando falten estos días para el vencimiento
 ALERT_DAYS=60,30,15,7,1,0
 
+# Días hacia atrás para recuperar avisos no enviados (servidor apagado a las 8:00, job fallido).
+# Se envía solo el umbral más urgente ya cruzado de cada persona. 0 = desactivado
+ALERT_CATCHUP_DAYS=0
+# Días de alertas programadas que se muestran en Configuración
+FORECAST_DAYS=14
+
 # Configuración de Email (SMTP)
 SMTP_HOST=smtp.gmail.com
 SMTP_PORT=587
@@ -18,5 +24,56 @@ TWILIO_ACCOUNT_SID=tu-account-sid
 TWILIO_AUTH_TOKEN=tu-auth-token
 TWILIO_FROM_PHONE=+1234567890
 
+# Envío de notificaciones
+# ALERT_MODE=threads usa pools de hilos por canal; ALERT_MODE=async usa asyncio
+ALERT_MODE=threads
+EMAIL_WORKERS=2
+SMS_WORKERS=4
+SMTP_POOL_SIZE=2
+SMTP_MAX_MESSAGES_PER_CONN=100
+# Procesos en paralelo para chequeos muy grandes (las alertas se reparten por destinatario)
+ALERT_SHARDS=1
+# ALERT_DIGEST=1 agrupa en un solo mensaje las especializaciones de un mismo destinatario
+ALERT_DIGEST=0
+ASYNC_CONCURRENCY=20
+ASYNC_TIMEOUT=30
+# Límite de envío por proveedor (mensajes por segundo y ráfaga); 0 = sin límite
+# Ej: un relay SMTP de 60 mensajes/minuto -> EMAIL_RATE=1; Twilio acepta 1 SMS/s por número largo
+EMAIL_RATE=0
+EMAIL_BURST=1
+SMS_RATE=1
+SMS_BURST=1
+# Aviso si un SMS ocupa más segmentos que este valor (cada segmento se cobra aparte)
+SMS_MAX_SEGMENTS=3
+# Carpeta opcional con plantillas Jinja que reemplazan las de por defecto:
+# email_subject.txt, email_body.txt, digest_subject.txt, digest_body.txt, sms.txt
+MESSAGE_TEMPLATES_DIR=
+
+# Reintentos de envíos fallidos (outbox): espera = OUTBOX_BASE_DELAY · 2^(intentos-1), tope OUTBOX_MAX_DELAY
+OUTBOX_INTERVAL=60
+OUTBOX_BATCH=200
+OUTBOX_BASE_DELAY=60
+OUTBOX_MAX_DELAY=3600
+OUTBOX_MAX_ATTEMPTS=8
+OUTBOX_SENDING_TIMEOUT=900
+
+# Arrancar el scheduler al importar la aplicación (necesario con gunicorn, que no ejecuta app.py
+# como __main__). Con varios workers solo el líder (lock en la base de datos) ejecuta las tareas
+SCHEDULER_AUTOSTART=0
+SCHEDULER_HEARTBEAT=30
+SCHEDULER_LEASE_TTL=90
+# Un solo envío a la vez entre todos los procesos (chequeo, /run-check y outbox), para que
+# EMAIL_RATE / SMS_RATE y SMTP_POOL_SIZE valgan para toda la instalación.
+# SEND_LEASE_TTL: duración máxima esperada de un envío; SEND_LEASE_WAIT: segundos que el
+# chequeo diario espera a que termine un envío en curso antes de omitirse
+SEND_LEASE_TTL=3600
+SEND_LEASE_WAIT=900
+
+# Milisegundos que una escritura espera a otra antes de fallar con "database is locked"
+SQLITE_BUSY_TIMEOUT=5000
+
+# Segundos que se guardan en memoria los contadores del panel principal
+STATS_CACHE_TTL=60
+
 # Nota: Para Gmail, necesitas crear una "App Password" desde tu cuenta de Google
 # Ve a: https://myaccount.google.com/apppasswords
\ No newline at end of file
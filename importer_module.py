@@ -32,9 +32,13 @@ def parse_date(value):
     
     return None
 
-def load_people_from_excel(filepath: str):
+def iter_people_from_excel(filepath: str, on_skip=None, on_reject=None):
     """
-    Lee un archivo Excel y retorna una lista de diccionarios con los datos de las personas.
+    Lee un archivo Excel en modo streaming (read_only) y genera un diccionario por
+    cada persona válida, sin cargar la hoja completa en memoria.
+    
+    - on_skip(fila): se llama por cada fila vacía
+    - on_reject(fila, motivo, valores): se llama por cada fila descartada
     
     Columnas esperadas:
     - nombre
@@ -47,45 +51,67 @@ def load_people_from_excel(filepath: str):
     - email
     - celular
     """
-    wb = openpyxl.load_workbook(filepath)
-    sheet = wb.active
-    
-    # Leer encabezados (primera fila)
-    headers = []
-    for cell in sheet[1]:
-        if cell.value:
-            headers.append(str(cell.value).strip().lower())
-        else:
-            headers.append(None)
-    
-    # Validar que existen las columnas requeridas
-    required = ['nombre', 'apellido', 'especializacion', 'fecha_vencimiento']
-    for req in required:
-        if req not in headers:
-            raise ValueError(f"Falta la columna requerida: {req}")
-    
-    # Leer datos
-    people = []
-    for row in sheet.iter_rows(min_row=2, values_only=True):
-        # Saltar filas vacías
-        if not any(row):
-            continue
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        sheet = wb.active
+        rows = sheet.iter_rows(values_only=True)
         
-        # Crear diccionario con los datos
-        person = {}
-        for i, header in enumerate(headers):
-            if header and i < len(row):
-                value = row[i]
-                
-                # Convertir fechas
-                if header in ['fecha_expedicion', 'fecha_vencimiento']:
-                    person[header] = parse_date(value)
-                else:
-                    person[header] = str(value).strip() if value else ""
+        # Leer encabezados (primera fila)
+        headers = []
+        for value in next(rows, None) or ():
+            if value:
+                headers.append(str(value).strip().lower())
+            else:
+                headers.append(None)
         
-        # Validar que tenga los campos requeridos
-        if all(person.get(req) for req in ['nombre', 'apellido', 'especializacion', 'fecha_vencimiento']):
-            people.append(person)
-    
-    wb.close()
-    return people
\ No newline at end of file
+        # Validar que existen las columnas requeridas
+        required = ['nombre', 'apellido', 'especializacion', 'fecha_vencimiento']
+        for req in required:
+            if req not in headers:
+                raise ValueError(f"Falta la columna requerida: {req}")
+        
+        # Leer datos
+        for row_number, row in enumerate(rows, start=2):
+            # Saltar filas vacías
+            if not any(row):
+                if on_skip:
+                    on_skip(row_number)
+                continue
+            
+            # Crear diccionario con los datos
+            person = {}
+            for i, header in enumerate(headers):
+                if header and i < len(row):
+                    value = row[i]
+                    
+                    # Convertir fechas
+                    if header in ['fecha_expedicion', 'fecha_vencimiento']:
+                        person[header] = parse_date(value)
+                    else:
+                        person[header] = str(value).strip() if value else ""
+            
+            # Validar que tenga los campos requeridos
+            missing = [req for req in required if not person.get(req)]
+            if missing:
+                if on_reject:
+                    values = {h: row[i] for i, h in enumerate(headers) if h and i < len(row)}
+                    on_reject(row_number, f"Campos vacíos o inválidos: {', '.join(missing)}", values)
+                continue
+            yield person
+    finally:
+        wb.close()
+
+def load_people_from_excel(filepath: str):
+    """Lee un archivo Excel y retorna una lista con todas las personas (ver iter_people_from_excel)"""
+    return list(iter_people_from_excel(filepath))
+
+def iter_chunks(iterable, size: int):
+    """Agrupa un iterable en listas de como máximo `size` elementos"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1,10 +1,195 @@
 import os
+import asyncio
+import time
 import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
 
-def send_email(to_email: str, subject: str, body: str):
+class TokenBucket:
+    """
+    Limitador de envíos por cubeta de tokens: rate tokens por segundo y ráfaga de
+    hasta burst mensajes seguidos. reserve() aparta un token y devuelve cuántos
+    segundos hay que esperar antes de usarlo, así sirve igual para hilos (time.sleep)
+    que para asyncio (asyncio.sleep). Las esperas quedan escalonadas en orden de llegada.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+_send_share = 1
+
+def set_send_share(shares):
+    """
+    Indica que este proceso es uno de `shares` que envían a la vez (ALERT_SHARDS): cada uno
+    usa 1/shares del rate, de la ráfaga y de las conexiones SMTP configuradas, para que entre
+    todos no superen los límites del proveedor.
+    """
+    global _send_share
+    _send_share = max(1, int(shares))
+
+def smtp_pool_size():
+    """Conexiones SMTP que puede abrir este proceso (SMTP_POOL_SIZE repartido entre procesos)"""
+    return max(1, int(os.getenv("SMTP_POOL_SIZE", "2")) // _send_share)
+
+def get_rate_limiter(channel, provider):
+    """
+    Devuelve el limitador compartido del proceso para (canal, proveedor): servidor SMTP
+    o número de Twilio. Lo usan todos los envíos (chequeo diario, /run-check, outbox).
+    El limitador es de este proceso: la aplicación solo deja enviar a un proceso a la vez
+    (lock "send" en la base de datos), así el límite vale para toda la instalación.
+    Configurar con EMAIL_RATE / EMAIL_BURST y SMS_RATE / SMS_BURST (mensajes por segundo
+    y ráfaga); un rate de 0 desactiva el límite y devuelve None.
+    """
+    prefix = channel.upper()
+    rate = float(os.getenv(f"{prefix}_RATE", "1" if channel == "sms" else "0")) / _send_share
+    burst = float(os.getenv(f"{prefix}_BURST", "1")) / _send_share
+    if rate <= 0:
+        return None
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get((channel, provider))
+        if limiter is None or (limiter.rate, limiter.burst) != (rate, max(1.0, burst)):
+            limiter = _rate_limiters[(channel, provider)] = TokenBucket(rate, burst)
+        return limiter
+
+class SMTPPool:
+    """
+    Pool de sesiones SMTP autenticadas (STARTTLS + LOGIN una sola vez por conexión).
+    Las conexiones se reutilizan durante todo un chequeo, se reconectan si el servidor
+    las cierra y se renuevan al alcanzar max_messages mensajes.
+    """
+
+    def __init__(self, host, port, user, password, max_size=2, max_messages=100, timeout=30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = []  # [servidor, mensajes_enviados]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        server.starttls()
+        server.login(self.user, self.password)
+        return [server, 0]
+
+    @staticmethod
+    def _quit(server):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    @staticmethod
+    def _session_alive(error):
+        """
+        True si la sesión sigue sirviendo después del error: un destinatario, remitente o
+        mensaje rechazado (smtplib ya hizo RSET). Desconexión, error de red o 421 la cierran.
+        """
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return False
+        if isinstance(error, smtplib.SMTPRecipientsRefused):
+            return all(code != 421 for code, _ in error.recipients.values())
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code != 421
+        return False
+
+    def _release(self, conn):
+        conn[1] += 1
+        if conn[1] >= self.max_messages:
+            self._quit(conn[0])
+        else:
+            with self._lock:
+                self._idle.append(conn)
+
+    def _after_error(self, conn, error):
+        # Un destinatario rechazado no obliga a repetir STARTTLS + LOGIN en el siguiente envío
+        if self._session_alive(error):
+            self._release(conn)
+        else:
+            self._quit(conn[0])
+
+    def send(self, msg):
+        with self._slots:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+
+            try:
+                conn[0].send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # El servidor cerró la sesión (timeout, reinicio): reconectar y reintentar una vez
+                self._quit(conn[0])
+                conn = self._connect()
+                try:
+                    conn[0].send_message(msg)
+                except Exception as e:
+                    self._after_error(conn, e)
+                    raise
+            except Exception as e:
+                self._after_error(conn, e)
+                raise
+
+            self._release(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._quit(server)
+
+def new_smtp_pool(max_size=None):
+    """
+    Pool SMTP nuevo con la configuración del entorno (None si faltan credenciales).
+    Cada envío masivo crea el suyo y lo cierra al terminar, así dos envíos simultáneos
+    (chequeo diario y outbox) no se cierran las sesiones el uno al otro.
+    """
+    smtp_user = os.getenv("SMTP_USER")
+    smtp_password = os.getenv("SMTP_PASSWORD")
+    if not smtp_user or not smtp_password:
+        return None
+    return SMTPPool(
+        os.getenv("SMTP_HOST", "smtp.gmail.com"), int(os.getenv("SMTP_PORT", "587")), smtp_user, smtp_password,
+        max_size=max_size or smtp_pool_size(),
+        max_messages=int(os.getenv("SMTP_MAX_MESSAGES_PER_CONN", "100")),
+        timeout=int(os.getenv("SMTP_TIMEOUT", "30")),
+    )
+
+def _build_email(from_email, to_email, subject, body):
+    msg = MIMEMultipart()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    return msg
+
+def send_email(to_email: str, subject: str, body: str, smtp_pool=None):
     """
     Envía un correo electrónico usando SMTP
     Configurar las siguientes variables de entorno:
@@ -13,6 +198,10 @@ def send_email(to_email: str, subject: str, body: str):
     - SMTP_USER (tu email)
     - SMTP_PASSWORD (tu contraseña o app password)
     - FROM_EMAIL (email remitente)
+    - SMTP_POOL_SIZE (conexiones simultáneas, por defecto 2)
+    - SMTP_MAX_MESSAGES_PER_CONN (mensajes antes de renovar la conexión, por defecto 100)
+    - EMAIL_RATE / EMAIL_BURST (mensajes por segundo y ráfaga; 0 = sin límite)
+    smtp_pool: sesiones a reutilizar (ver dispatch_messages); sin él se abre una conexión solo para este envío.
     """
     smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
     smtp_port = int(os.getenv("SMTP_PORT", "587"))
@@ -24,22 +213,44 @@ def send_email(to_email: str, subject: str, body: str):
         print("⚠ Credenciales SMTP no configuradas. No se puede enviar email.")
         return
 
-    msg = MIMEMultipart()
-    msg['From'] = from_email
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    msg = _build_email(from_email, to_email, subject, body)
 
+    limiter = get_rate_limiter("email", smtp_host)
+    if limiter is not None:
+        limiter.acquire()
+
+    pool = smtp_pool or SMTPPool(smtp_host, smtp_port, smtp_user, smtp_password, max_size=1,
+                                 timeout=int(os.getenv("SMTP_TIMEOUT", "30")))
     try:
-        server = smtplib.SMTP(smtp_host, smtp_port)
-        server.starttls()
-        server.login(smtp_user, smtp_password)
-        server.send_message(msg)
-        server.quit()
+        pool.send(msg)
         print(f"✓ Email enviado a {to_email}")
     except Exception as e:
         print(f"✗ Error enviando email a {to_email}: {e}")
         raise
+    finally:
+        if smtp_pool is None:
+            pool.close()
+
+_twilio_client = None
+_twilio_credentials = None
+_twilio_lock = threading.Lock()
+
+def get_twilio_client(account_sid, auth_token):
+    """
+    Devuelve el cliente Twilio del proceso, creado la primera vez que se usa.
+    Su sesión HTTP mantiene las conexiones abiertas entre envíos (keep-alive).
+    Se vuelve a crear si cambian las credenciales.
+    """
+    global _twilio_client, _twilio_credentials
+    with _twilio_lock:
+        if _twilio_client is None or _twilio_credentials != (account_sid, auth_token):
+            http_client = TwilioHttpClient(
+                pool_connections=True,
+                timeout=float(os.getenv("TWILIO_TIMEOUT", "30")),
+            )
+            _twilio_client = Client(account_sid, auth_token, http_client=http_client)
+            _twilio_credentials = (account_sid, auth_token)
+        return _twilio_client
 
 def send_sms(to_phone: str, message: str):
     """
@@ -48,6 +259,7 @@ def send_sms(to_phone: str, message: str):
     - TWILIO_ACCOUNT_SID
     - TWILIO_AUTH_TOKEN
     - TWILIO_FROM_PHONE (número de Twilio)
+    - SMS_RATE / SMS_BURST (mensajes por segundo y ráfaga por número, por defecto 1)
     """
     account_sid = os.getenv("TWILIO_ACCOUNT_SID")
     auth_token = os.getenv("TWILIO_AUTH_TOKEN")
@@ -57,8 +269,12 @@ def send_sms(to_phone: str, message: str):
         print("⚠ Credenciales Twilio no configuradas. No se puede enviar SMS.")
         return
 
+    limiter = get_rate_limiter("sms", from_phone)
+    if limiter is not None:
+        limiter.acquire()
+
     try:
-        client = Client(account_sid, auth_token)
+        client = get_twilio_client(account_sid, auth_token)
         msg = client.messages.create(
             body=message,
             from_=from_phone,
@@ -67,4 +283,250 @@ def send_sms(to_phone: str, message: str):
         print(f"✓ SMS enviado a {to_phone} (SID: {msg.sid})")
     except Exception as e:
         print(f"✗ Error enviando SMS a {to_phone}: {e}")
-        raise
\ No newline at end of file
+        raise
+
+# Alfabeto GSM 03.38: los caracteres de la tabla de extensión ocupan dos posiciones
+GSM7_BASIC = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€\f")
+
+def sms_segments(text: str):
+    """
+    Codificación y número de segmentos que cobrará el operador por un SMS.
+    GSM-7: 160 caracteres en un segmento, 153 por segmento si se divide.
+    UCS-2 (cualquier carácter fuera de GSM-7, p. ej. á, í, ó, ú): 70 y 67.
+    """
+    if all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text):
+        length = sum(2 if c in GSM7_EXTENDED else 1 for c in text)
+        single, multi, encoding = 160, 153, "GSM-7"
+    else:
+        # Los caracteres fuera del plano básico ocupan dos unidades UTF-16
+        length = sum(2 if ord(c) > 0xFFFF else 1 for c in text)
+        single, multi, encoding = 70, 67, "UCS-2"
+    if length <= single:
+        return encoding, 1
+    return encoding, -(-length // multi)
+
+def send_sms_many(messages):
+    """
+    Envía varios SMS seguidos reutilizando el mismo cliente Twilio y su sesión HTTP.
+    messages: iterable de (celular, mensaje). Retorna (enviados, errores).
+    """
+    sent_count = 0
+    errors = 0
+    for to_phone, message in messages:
+        try:
+            send_sms(to_phone, message)
+            sent_count += 1
+        except Exception:
+            errors += 1
+    return sent_count, errors
+
+def _send_message(message, smtp_pool=None):
+    if message["channel"] == "email":
+        send_email(message["to"], message["subject"], message["body"], smtp_pool=smtp_pool)
+    else:
+        send_sms(message["to"], message["body"])
+
+def dispatch_messages(messages, on_sent=None, on_error=None, smtp_pool=None):
+    """
+    Envía los mensajes con un pool de hilos por canal.
+    Los emails comparten sesiones SMTP autenticadas durante todo el envío: las de smtp_pool
+    si se pasa, o las de un pool propio (new_smtp_pool) que se cierra al terminar.
+    Cada mensaje es un dict con: channel ("email" o "sms"), to, subject, body.
+    on_sent(message) y on_error(message, error) se llaman desde el hilo que invoca
+    esta función, una vez por mensaje, para que el registro en la base de datos no
+    salga de ese hilo.
+    Configurar con EMAIL_WORKERS y SMS_WORKERS (hilos simultáneos por canal).
+    Retorna (enviados, errores).
+    """
+    workers = {
+        "email": int(os.getenv("EMAIL_WORKERS", "2")),
+        "sms": int(os.getenv("SMS_WORKERS", "4")),
+    }
+    executors = {
+        channel: ThreadPoolExecutor(max_workers=max(1, n), thread_name_prefix=f"notify-{channel}")
+        for channel, n in workers.items()
+    }
+    pool = smtp_pool
+    if pool is None and any(m["channel"] == "email" for m in messages):
+        pool = new_smtp_pool()
+    sent_count = 0
+    errors = 0
+    try:
+        futures = {executors[m["channel"]].submit(_send_message, m, pool): m for m in messages}
+        for future in as_completed(futures):
+            message = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error enviando {message['channel']}: {e}")
+                errors += 1
+                if on_error:
+                    on_error(message, e)
+                continue
+            sent_count += 1
+            if on_sent:
+                on_sent(message)
+    finally:
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        if smtp_pool is None and pool is not None:
+            pool.close()
+    return sent_count, errors
+
+# ============ MODO ASÍNCRONO ============
+class AsyncSMTPPool:
+    """Equivalente asyncio de SMTPPool sobre aiosmtplib"""
+
+    def __init__(self, host, port, user, password, max_size=2, max_messages=100, timeout=30):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.max_messages = max_messages
+        self.timeout = timeout
+        self._idle = []  # [servidor, mensajes_enviados]
+        self._slots = asyncio.Semaphore(max_size)
+
+    async def _connect(self):
+        import aiosmtplib
+
+        server = aiosmtplib.SMTP(hostname=self.host, port=self.port, timeout=self.timeout, start_tls=True)
+        try:
+            await server.connect()
+            await server.login(self.user, self.password)
+        except BaseException:
+            server.close()
+            raise
+        return [server, 0]
+
+    @staticmethod
+    async def _quit(server):
+        try:
+            await server.quit()
+        except Exception:
+            server.close()
+
+    async def send(self, msg):
+        import aiosmtplib
+
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                try:
+                    await conn[0].send_message(msg)
+                except aiosmtplib.SMTPServerDisconnected:
+                    await self._quit(conn[0])
+                    conn = await self._connect()
+                    await conn[0].send_message(msg)
+            except Exception:
+                await self._quit(conn[0])
+                raise
+            except BaseException:
+                # Cancelado (timeout de wait_for): el socket se cierra sin esperar al QUIT
+                conn[0].close()
+                raise
+
+            conn[1] += 1
+            if conn[1] >= self.max_messages:
+                await self._quit(conn[0])
+            else:
+                self._idle.append(conn)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for server, _ in idle:
+            await self._quit(server)
+
+async def dispatch_messages_async(messages, on_sent=None, on_error=None):
+    """
+    Variante asyncio de dispatch_messages: un solo hilo con E/S cooperativa.
+    Email por aiosmtplib (pool de sesiones) y SMS por la API REST de Twilio con httpx.
+    Configurar con:
+    - ASYNC_CONCURRENCY (envíos simultáneos, por defecto 20)
+    - ASYNC_TIMEOUT (segundos por envío, por defecto 30)
+    Retorna (enviados, errores), igual que dispatch_messages.
+    """
+    import httpx
+
+    concurrency = max(1, int(os.getenv("ASYNC_CONCURRENCY", "20")))
+    timeout = float(os.getenv("ASYNC_TIMEOUT", "30"))
+
+    smtp_host = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    smtp_port = int(os.getenv("SMTP_PORT", "587"))
+    smtp_user = os.getenv("SMTP_USER")
+    smtp_password = os.getenv("SMTP_PASSWORD")
+    from_email = os.getenv("FROM_EMAIL", smtp_user)
+
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    from_phone = os.getenv("TWILIO_FROM_PHONE")
+
+    smtp_pool = None
+    if smtp_user and smtp_password:
+        smtp_pool = AsyncSMTPPool(
+            smtp_host, smtp_port, smtp_user, smtp_password,
+            max_size=min(concurrency, smtp_pool_size()),
+            max_messages=int(os.getenv("SMTP_MAX_MESSAGES_PER_CONN", "100")),
+            timeout=timeout,
+        )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    sms_url = f"https://api.twilio.com/2010-04-01/Accounts/{account_sid}/Messages.json"
+
+    email_limiter = get_rate_limiter("email", smtp_host)
+    sms_limiter = get_rate_limiter("sms", from_phone)
+
+    async def send_one(http, message):
+        # La espera del limitador va antes del semáforo para no ocupar un cupo durmiendo
+        limiter = email_limiter if message["channel"] == "email" else sms_limiter
+        if limiter is not None:
+            await asyncio.sleep(limiter.reserve())
+        async with semaphore:
+            if message["channel"] == "email":
+                if smtp_pool is None:
+                    print("⚠ Credenciales SMTP no configuradas. No se puede enviar email.")
+                    return
+                msg = _build_email(from_email, message["to"], message["subject"], message["body"])
+                await asyncio.wait_for(smtp_pool.send(msg), timeout)
+                print(f"✓ Email enviado a {message['to']}")
+            else:
+                if not account_sid or not auth_token or not from_phone:
+                    print("⚠ Credenciales Twilio no configuradas. No se puede enviar SMS.")
+                    return
+                resp = await http.post(sms_url, data={"To": message["to"], "From": from_phone, "Body": message["body"]})
+                resp.raise_for_status()
+                print(f"✓ SMS enviado a {message['to']} (SID: {resp.json().get('sid')})")
+
+    async def run_one(http, message):
+        try:
+            await send_one(http, message)
+        except Exception as e:
+            return message, e
+        return message, None
+
+    sent_count = 0
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    auth = (account_sid, auth_token) if account_sid and auth_token else None
+    try:
+        async with httpx.AsyncClient(auth=auth, timeout=timeout, limits=limits) as http:
+            tasks = [asyncio.ensure_future(run_one(http, m)) for m in messages]
+            for task in asyncio.as_completed(tasks):
+                message, error = await task
+                if error is not None:
+                    print(f"Error enviando {message['channel']}: {error!r}")
+                    errors += 1
+                    if on_error:
+                        on_error(message, error)
+                    continue
+                sent_count += 1
+                if on_sent:
+                    on_sent(message)
+    finally:
+        if smtp_pool is not None:
+            await smtp_pool.close()
+    return sent_count, errors
@@ -0,0 +1,218 @@
+"""Pruebas de dispatch_messages contra un servidor SMTP local falso y un cliente Twilio simulado"""
+import base64
+import shutil
+import socketserver
+import ssl
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import notify_module as notify  # noqa: E402
+
+
+# ============ SERVIDOR SMTP FALSO ============
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """SMTP mínimo con STARTTLS y AUTH; rechaza (550) los destinatarios de `reject`"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, tls_context, reject=()):
+        super().__init__(("127.0.0.1", 0), FakeSMTPHandler)
+        self.tls = tls_context
+        self.reject = set(reject)
+        self.delivered = []
+        self.logins = 0
+        self.open_sessions = 0
+        self.lock = threading.Lock()
+
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, *lines):
+        self.wfile.write("".join(f"{line}\r\n" for line in lines).encode())
+        self.wfile.flush()
+
+    def handle(self):
+        with self.server.lock:
+            self.server.open_sessions += 1
+        try:
+            self.session()
+        finally:
+            with self.server.lock:
+                self.server.open_sessions -= 1
+
+    def session(self):
+        server = self.server
+        tls = False
+        recipients = []
+        self.reply("220 fake ESMTP")
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode().strip()
+            cmd = line.split(" ", 1)[0].upper()
+            if cmd in ("EHLO", "HELO"):
+                if tls:
+                    self.reply("250-fake", "250 AUTH PLAIN LOGIN")
+                else:
+                    self.reply("250-fake", "250-AUTH PLAIN LOGIN", "250 STARTTLS")
+            elif cmd == "STARTTLS":
+                self.reply("220 ready")
+                self.connection = server.tls.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb")
+                tls = True
+            elif cmd == "AUTH":
+                base64.b64decode(line.split()[-1])
+                with server.lock:
+                    server.logins += 1
+                self.reply("235 ok")
+            elif cmd in ("MAIL", "RSET"):
+                recipients = []
+                self.reply("250 ok")
+            elif cmd == "RCPT":
+                to = line.split(":", 1)[1].strip().strip("<>")
+                if to in server.reject:
+                    self.reply("550 no such user")
+                else:
+                    recipients.append(to)
+                    self.reply("250 ok")
+            elif cmd == "DATA":
+                self.reply("354 go ahead")
+                while self.rfile.readline().rstrip(b"\r\n") != b".":
+                    pass
+                with server.lock:
+                    server.delivered.extend(recipients)
+                self.reply("250 queued")
+            elif cmd == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 unknown")
+
+
+@pytest.fixture(scope="module")
+def tls_context(tmp_path_factory):
+    if shutil.which("openssl") is None:
+        pytest.skip("openssl no disponible para generar el certificado del SMTP falso")
+    directory = tmp_path_factory.mktemp("cert")
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-subj", "/CN=localhost",
+                    "-days", "1", "-keyout", str(key), "-out", str(cert)], check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(str(cert), str(key))
+    return context
+
+
+@pytest.fixture
+def smtp_server(tls_context, monkeypatch):
+    server = FakeSMTPServer(tls_context, reject={"rechazado@example.com"})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("SMTP_HOST", "127.0.0.1")
+    monkeypatch.setenv("SMTP_PORT", str(server.server_address[1]))
+    monkeypatch.setenv("SMTP_USER", "alertas@example.com")
+    monkeypatch.setenv("SMTP_PASSWORD", "secreto")
+    monkeypatch.setenv("SMTP_POOL_SIZE", "2")
+    monkeypatch.setenv("EMAIL_WORKERS", "4")
+    monkeypatch.setenv("EMAIL_RATE", "0")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+# ============ CLIENTE TWILIO SIMULADO ============
+class FakeTwilioClient:
+    """Reemplaza twilio.rest.Client: guarda los SMS y falla para los números de `failing`"""
+    sent = []
+    failing = {"+570000000"}
+
+    def __init__(self, account_sid, auth_token, http_client=None):
+        self.messages = self
+
+    def create(self, body, from_, to):
+        if to in self.failing:
+            raise RuntimeError("Twilio 21211: número inválido")
+        self.sent.append(to)
+        return type("Message", (), {"sid": f"SM{len(self.sent)}"})()
+
+
+@pytest.fixture
+def twilio(monkeypatch):
+    FakeTwilioClient.sent = []
+    monkeypatch.setattr(notify, "Client", FakeTwilioClient)
+    monkeypatch.setattr(notify, "_twilio_client", None)
+    monkeypatch.setenv("TWILIO_ACCOUNT_SID", "AC123")
+    monkeypatch.setenv("TWILIO_AUTH_TOKEN", "token")
+    monkeypatch.setenv("TWILIO_FROM_PHONE", "+15550000")
+    monkeypatch.setenv("SMS_WORKERS", "4")
+    monkeypatch.setenv("SMS_RATE", "0")
+    return FakeTwilioClient
+
+
+def email(i, to=None):
+    return {"id": f"e{i}", "channel": "email", "to": to or f"persona{i}@example.com",
+            "subject": "Vencimiento", "body": "Hola"}
+
+
+def sms(i, to=None):
+    return {"id": f"s{i}", "channel": "sms", "to": to or f"+57300{i:04d}", "subject": None, "body": "Hola"}
+
+
+# ============ PRUEBAS ============
+def test_dispatch_sends_every_message_once(smtp_server, twilio):
+    messages = [email(i) for i in range(12)] + [sms(i) for i in range(8)]
+    sent, errors = [], []
+
+    result = notify.dispatch_messages(messages, on_sent=sent.append,
+                                      on_error=lambda m, e: errors.append(m))
+
+    assert result == (20, 0)
+    assert sorted(m["id"] for m in sent) == sorted(m["id"] for m in messages)
+    assert errors == []
+    assert sorted(smtp_server.delivered) == sorted(m["to"] for m in messages if m["channel"] == "email")
+    assert sorted(twilio.sent) == sorted(m["to"] for m in messages if m["channel"] == "sms")
+
+
+def test_failures_are_counted_and_never_reported_as_sent(smtp_server, twilio):
+    bad_email = email(99, to="rechazado@example.com")
+    bad_sms = sms(99, to="+570000000")
+    messages = [email(1), bad_email, sms(1), bad_sms, email(2)]
+    sent, errors = [], []
+
+    result = notify.dispatch_messages(messages, on_sent=sent.append,
+                                      on_error=lambda m, e: errors.append(m))
+
+    assert result == (3, 2)
+    assert sorted(m["id"] for m in sent) == ["e1", "e2", "s1"]
+    assert sorted(m["id"] for m in errors) == ["e99", "s99"]
+    assert not {m["id"] for m in sent} & {m["id"] for m in errors}
+
+
+def test_dispatch_reuses_and_closes_its_smtp_sessions(smtp_server, twilio):
+    notify.dispatch_messages([email(i) for i in range(10)])
+
+    # SMTP_POOL_SIZE=2: como mucho dos inicios de sesión para diez correos
+    assert len(smtp_server.delivered) == 10
+    assert smtp_server.logins <= 2
+    deadline = time.time() + 2
+    while smtp_server.open_sessions and time.time() < deadline:
+        time.sleep(0.05)
+    assert smtp_server.open_sessions == 0
+
+
+def test_refused_recipients_keep_the_smtp_session(smtp_server, twilio):
+    smtp_server.reject.update(f"malo{i}@example.com" for i in range(5))
+    messages = [email(i) for i in range(5)] + [email(10 + i, to=f"malo{i}@example.com") for i in range(5)]
+
+    result = notify.dispatch_messages(messages)
+
+    # Los 550 no cierran la sesión: no se repite STARTTLS + LOGIN por cada rechazo
+    assert result == (5, 5)
+    assert len(smtp_server.delivered) == 5
+    assert smtp_server.logins <= 2